@@ -0,0 +1,483 @@
+import time
+import_started = time.perf_counter()  # 模块导入计时的起点（见 startup.py）
+import asyncio
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+from urllib.parse import quote
+
+from PIL import UnidentifiedImageError
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import guardrails
+import startup
+import timing
+from colorspace import SPACES
+from decode import DecodedUpload
+from encoders import OUTPUT_FORMATS, encode_image
+from frames import extract_clip_palettes, iter_frames, probe, render_scene_strip
+from layout import MAX_COLORS, MIN_COLORS, WALLPAPER_RATIOS, orientation, parse_resolution
+from palette_image import (
+    center_crop_to_square, hex_to_rgb, make_palette_image, make_wallpaper, palette_hierarchy,
+)
+from palette_index import get_index
+from quantize import QUANTIZERS
+from result_store import cached_bytes, content_digest
+from swatches import SHAPES as SWATCH_SHAPES
+from variants import build_zip, render_bytes, render_variants
+
+# 色板 HTTP 接口（与 Streamlit 页面并行部署）：
+#   pip install -r requirements-api.txt
+#   uvicorn api:app --host 0.0.0.0 --port 8000
+#
+#   POST /palette    multipart 字段 file=图片 → JSON：十六进制颜色及像素占比
+#   POST /card       → 色板拼接图（make_palette_image 的输出）
+#   POST /wallpaper  → 壁纸（make_wallpaper 的输出）
+#   POST /variants   → zip：shapes × bgs × ratios 全部组合的色板图及壁纸，解码和聚类只做一次
+#   POST /search     → JSON：色板索引中色板与上传图片最相近的图片（需设置 PALETTE_INDEX，见 palette_index.py）
+#   GET  /search?color=#RRGGBB → JSON：含有该颜色的图片，可加 max_delta_e、min_weight
+#   /search 另有 top=返回条数（默认 10，最多 MAX_SEARCH_TOP）
+#   POST /clip       动图（GIF/WebP/APNG）或视频（需安装 PyAV）→ JSON：整段色板及各场景的色板
+#   POST /clip/strip → 各场景色板卡拼成的图片；两者另有 every=每隔几帧取一帧  keyframes=0|1（视频只解关键帧）
+# 参数可放在 query string 或 multipart 表单字段：
+#   num_colors=3～24  wide=0|1  shape=square|circle|rounded|hexagon  bg=white|black|#RRGGBB  method=kmeans|histogram|mediancut
+#   max_edge=像素（0 表示原图尺寸）  format=png|webp|jpeg…  ratio=desktop|phone|宽:高  fill=填充色序号（从 1 开始）
+#   size=宽x高 或设备名（见 layout.DEVICE_RESOLUTIONS），壁纸按该分辨率精确输出
+#   /variants 另有逗号分隔的 shapes=square,circle  bgs=white,black  ratios=desktop,phone（也可写 宽x高 分辨率）
+#   space=rgb|lab|oklab  merge_delta_e=合并近似重复色的 ΔE 阈值（0 表示不合并）
+#
+# 解码和聚类在有界线程池中执行，事件循环从不阻塞；排队的任务超过上限时直接返回 503，
+# 由客户端稍后重试，避免一张大图拖慢所有人。环境变量：
+#   PALETTE_API_WORKERS       并发执行的任务数（默认 CPU 核数）
+#   PALETTE_API_MAX_PENDING   执行中 + 排队中的任务上限（默认 WORKERS × 4）
+#   PALETTE_API_MAX_UPLOAD_MB 单个上传文件大小上限（默认 30）
+#   PALETTE_STORE             共享结果库路径（见 result_store.py），与 Streamlit 页面共用同一个文件即可互相命中
+# 像素数、内存预算和单个任务的耗时另有限制（见 guardrails.py）：图片过大返回 413，
+# 排队超时返回 503，处理超时返回 504
+# sklearn 在启动后由后台线程预热，PALETTE_WARMUP=sync 时预热完才开始接受请求（见 startup.py）；
+# /health 的 startup 字段给出导入、预热和第一个请求的耗时
+
+MAX_WORKERS = int(os.environ.get("PALETTE_API_WORKERS", os.cpu_count() or 2))
+MAX_PENDING = int(os.environ.get("PALETTE_API_MAX_PENDING", MAX_WORKERS * 4))
+MAX_UPLOAD_BYTES = int(float(os.environ.get("PALETTE_API_MAX_UPLOAD_MB", "30")) * 2 ** 20)
+DEFAULT_MAX_EDGE = 2048
+MAX_DEVICE_EDGE = 8192
+# ratio=宽:高 的长短边之比上限：壁纸画布由色板图按比例补边而来，比例越极端画布越大（32:9 带鱼屏约 3.6）
+MAX_ASPECT = 4
+MAX_SEARCH_TOP = 200
+
+SHAPES = {"square": "方形", "circle": "圆形", "rounded": "圆角方形", "hexagon": "六边形", **{s: s for s in SWATCH_SHAPES}}
+BG_COLORS = {"white": "#F5F5F5", "black": "#1C1C1C", "白色": "#F5F5F5", "黑色": "#1C1C1C"}
+RATIOS = {"desktop": WALLPAPER_RATIOS["桌面"], "phone": WALLPAPER_RATIOS["手机"], **WALLPAPER_RATIOS}
+
+
+class BadRequest(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Busy(Exception):
+    pass
+
+
+class WorkerPool:
+    # 有界线程池 + 排队上限；pending 只在事件循环线程中修改，无需加锁
+    def __init__(self, workers=MAX_WORKERS, max_pending=MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="palette-api")
+        self.max_pending = max_pending
+        self.pending = 0
+
+    def full(self):
+        return self.pending >= self.max_pending
+
+    async def run(self, fn, *args):
+        if self.full():
+            raise Busy()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+pool = WorkerPool()
+
+
+def split_list(text):
+    return [item.strip() for item in text.split(",") if item.strip()]
+
+
+def parse_params(values):
+    try:
+        num_colors = int(values.get("num_colors", 5))
+        max_edge = int(values.get("max_edge", DEFAULT_MAX_EDGE)) or None
+        fill = int(values.get("fill", 1))
+        merge_delta_e = float(values.get("merge_delta_e", 0)) or None
+    except ValueError as e:
+        raise BadRequest(f"参数格式错误：{e}")
+    if not MIN_COLORS <= num_colors <= MAX_COLORS:
+        raise BadRequest(f"num_colors 只支持 {MIN_COLORS}～{MAX_COLORS}")
+    shape = SHAPES.get(values.get("shape", "square"))
+    if shape is None:
+        raise BadRequest("shape 只支持 square、circle、rounded、hexagon")
+    method = values.get("method", "kmeans")
+    if method not in QUANTIZERS:
+        raise BadRequest(f"method 只支持 {', '.join(QUANTIZERS)}")
+    space = values.get("space", "rgb")
+    if space not in SPACES:
+        raise BadRequest(f"space 只支持 {', '.join(SPACES)}")
+    fmt = values.get("format", "png")
+    if fmt not in OUTPUT_FORMATS:
+        raise BadRequest(f"format 只支持 {', '.join(OUTPUT_FORMATS)}")
+    ratio_name = values.get("ratio", "desktop")
+    ratio = RATIOS.get(ratio_name) or parse_resolution(ratio_name.replace(":", "x"))
+    if ratio is None or max(ratio) / min(ratio) > MAX_ASPECT:
+        raise BadRequest(f"ratio 只支持 desktop、phone 或 宽:高（长短边之比不超过 {MAX_ASPECT}）")
+    device = None
+    if values.get("size"):
+        device = parse_resolution(values["size"])
+        if device is None or max(device) > MAX_DEVICE_EDGE:
+            raise BadRequest(f"size 应为 宽x高（最长边不超过 {MAX_DEVICE_EDGE}）或设备名")
+    try:
+        bg_color = hex_to_rgb(BG_COLORS.get(values.get("bg", "white"), values.get("bg", "white")))
+    except ValueError:
+        raise BadRequest("bg 应为 white、black 或 #RRGGBB")
+    variant_shapes = [SHAPES.get(name) for name in split_list(values.get("shapes", "square,circle"))]
+    if not variant_shapes or None in variant_shapes:
+        raise BadRequest("shapes 只支持 square、circle、rounded、hexagon")
+    variant_bgs = {}
+    for name in split_list(values.get("bgs", "white,black")):
+        try:
+            variant_bgs[name] = hex_to_rgb(BG_COLORS.get(name, name))
+        except ValueError:
+            raise BadRequest("bgs 应为 white、black 或 #RRGGBB")
+    variant_wallpapers = []
+    for name in split_list(values.get("ratios", "desktop,phone")):
+        if name in RATIOS:
+            variant_wallpapers.append((RATIOS[name], None))
+            continue
+        size = parse_resolution(name)
+        if size is None or max(size) > MAX_DEVICE_EDGE:
+            raise BadRequest("ratios 只支持 desktop、phone 或 宽x高 分辨率")
+        variant_wallpapers.append((size, size))
+    if not variant_bgs:
+        raise BadRequest("bgs 不能为空")
+    return {
+        "variant_shapes": list(dict.fromkeys(variant_shapes)),
+        "variant_bgs": variant_bgs,
+        "variant_wallpapers": variant_wallpapers,
+        "num_colors": num_colors,
+        "wide_palette": values.get("wide", "0") in ("1", "true", "yes") and num_colors == 5,
+        "shape": shape,
+        "method": method,
+        "bg_color": bg_color,
+        "max_edge": max_edge,
+        "format": fmt,
+        "ratio": ratio,
+        "device": device,
+        "fill_index": max(fill, 1) - 1,
+        "space": space,
+        "merge_delta_e": merge_delta_e,
+    }
+
+
+async def read_upload(request):
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > MAX_UPLOAD_BYTES + 64 * 1024:
+        raise BadRequest("上传文件过大", status_code=413)
+    # multipart 由 python-multipart 流式解析，大文件会落到临时文件而不是整段读进内存
+    async with request.form(max_files=1, max_fields=20) as form:
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise BadRequest("缺少图片字段 file")
+        if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+            raise BadRequest("上传文件过大", status_code=413)
+        data = await upload.read()
+        values = {**request.query_params, **{k: v for k, v in form.items() if isinstance(v, str)}}
+    params = parse_params(values)
+    params["name"] = os.path.splitext(os.path.basename(upload.filename or ""))[0] or "image"
+    return data, params
+
+
+def decode(data):
+    try:
+        return DecodedUpload(io.BytesIO(data))
+    except (UnidentifiedImageError, OSError) as e:
+        raise BadRequest(f"无法解码图片：{e}", status_code=415)
+
+
+@contextmanager
+def admitted(data, full=True, extra=None):
+    # 读文件头检查像素数，再按估计的内存占用排队（见 guardrails.guarded）；
+    # extra(尺寸) 为解码之外的额外占用，如 /variants 同时渲染的壁纸
+    try:
+        size, fmt = guardrails.peek_size(io.BytesIO(data))
+    except (UnidentifiedImageError, OSError) as e:
+        raise BadRequest(f"无法解码图片：{e}", status_code=415)
+    with guardrails.job(guardrails.estimate_bytes(size, fmt, full) + (extra(size) if extra else 0)):
+        yield
+
+
+def palette_job(data, params):
+    with timing.trace("api_palette", method=params["method"]), admitted(data, full=False):
+        upload = decode(data)
+        tree = palette_hierarchy(center_crop_to_square(upload.proxy), params["method"],
+                                 params["space"], params["merge_delta_e"])
+        picked = tree.pick_weighted(params["num_colors"], params["wide_palette"])
+        return {
+            "width": upload.size[0],
+            "height": upload.size[1],
+            "colors": [
+                {"hex": hex_color(c), "rgb": list(c), "weight": round(w, 4)}
+                for c, w in picked
+            ],
+        }
+
+
+def hex_color(color):
+    return '#%02x%02x%02x' % tuple(color)
+
+
+def render_card(upload, params):
+    return make_palette_image(
+        upload.full(), params["bg_color"], "", num_colors=params["num_colors"],
+        wide_palette=params["wide_palette"], shape=params["shape"], method=params["method"],
+        palette_source=upload.proxy, max_edge=params["max_edge"], fmt=params["format"],
+        space=params["space"], merge_delta_e=params["merge_delta_e"],
+    )
+
+
+def render_params(params):
+    # 影响输出字节的参数（文件名只影响响应头）
+    return {k: v for k, v in params.items() if k != "name"}
+
+
+def card_job(data, params):
+    with timing.trace("api_card", format=params["format"], max_edge=params["max_edge"]):
+        def render():
+            with admitted(data):
+                return render_card(decode(data), params)[0]
+        return cached_bytes(("api_card", content_digest(data), render_params(params)), render)
+
+
+def wallpaper_job(data, params):
+    with timing.trace("api_wallpaper", format=params["format"], max_edge=params["max_edge"]):
+        def outputs(size):
+            # 色板图和壁纸画布计入内存预算（与 /variants 相同的估计，只有一个组合）
+            return render_bytes(size, params["num_colors"], shapes=(params["shape"],),
+                                bg_colors={"": params["bg_color"]}, wallpapers=[(params["ratio"], params["device"])],
+                                max_edge=params["max_edge"])
+
+        def render():
+            with admitted(data, extra=outputs):
+                _, _, palette, card = render_card(decode(data), params)
+                fill = palette[min(params["fill_index"], len(palette) - 1)]
+                wallpaper = make_wallpaper(card, ratio=params["ratio"], color=fill, device=params["device"])
+                with timing.stage("wallpaper_encode"):
+                    return encode_image(wallpaper, params["format"])[0]
+        return cached_bytes(("api_wallpaper", content_digest(data), render_params(params)), render)
+
+
+def variants_job(data, params):
+    with timing.trace("api_variants", format=params["format"], max_edge=params["max_edge"]):
+        def outputs(size):
+            return render_bytes(size, params["num_colors"], params["variant_shapes"], params["variant_bgs"],
+                                params["variant_wallpapers"], params["max_edge"])
+
+        def render():
+            with admitted(data, extra=outputs):
+                files = render_variants(
+                    decode(data), params["name"], shapes=params["variant_shapes"], bg_colors=params["variant_bgs"],
+                    wallpapers=params["variant_wallpapers"], num_colors=params["num_colors"],
+                    wide_palette=params["wide_palette"], method=params["method"], space=params["space"],
+                    merge_delta_e=params["merge_delta_e"], max_edge=params["max_edge"], fmt=params["format"],
+                    fill_index=params["fill_index"],
+                )
+            with timing.stage("zip"):
+                return build_zip(files)
+        # zip 里的文件名取自上传文件名，所以键里保留 name
+        return cached_bytes(("api_variants", content_digest(data), params), render)
+
+
+def clip_job(data, params, every, keyframes, strip=False):
+    with timing.trace("api_clip_strip" if strip else "api_clip", every=every, keyframes=keyframes):
+        fp = io.BytesIO(data)
+        try:
+            _, size, _ = probe(fp)
+        except (UnidentifiedImageError, OSError) as e:
+            raise BadRequest(f"无法解码图片或视频：{e}", status_code=415)
+        # 任一时刻只解码一帧，按单帧估计内存（见 frames.py）
+        with guardrails.job(guardrails.estimate_bytes(size, full=False)):
+            combined, scenes = extract_clip_palettes(iter_frames(fp, every, keyframes), params["num_colors"],
+                                                     params["space"])
+            if strip:
+                img = render_scene_strip(scenes, params["bg_color"], num_colors=params["num_colors"],
+                                         shape=params["shape"])
+                with timing.stage("clip_encode"):
+                    return encode_image(img, params["format"])[0]
+        return {
+            "colors": [hex_color(c) for c in combined],
+            "scenes": [
+                {"start_frame": s.start_index, "start_ms": s.start_ms, "frames": s.frames,
+                 "colors": [hex_color(c) for c in s.palette]}
+                for s in scenes
+            ],
+        }
+
+
+def parse_clip(values):
+    try:
+        every = int(values.get("every", 1))
+    except ValueError as e:
+        raise BadRequest(f"参数格式错误：{e}")
+    if every < 1:
+        raise BadRequest("every 应为正整数")
+    return every, values.get("keyframes", "0") in ("1", "true", "yes")
+
+
+def search_palette_job(data, params, top):
+    with timing.trace("api_search_palette", top=top):
+        with admitted(data, full=False):
+            upload = decode(data)
+            tree = palette_hierarchy(center_crop_to_square(upload.proxy), params["method"],
+                                     params["space"], params["merge_delta_e"])
+            picked = tree.pick_weighted(params["num_colors"], params["wide_palette"])
+        results = get_index().search_palette([c for c, _ in picked], [w for _, w in picked], top)
+        return {"results": [{"key": key, "distance": dist} for key, dist in results]}
+
+
+def search_color_job(color, top, max_delta_e, min_weight):
+    with timing.trace("api_search_color", top=top):
+        results = get_index().search_color(color, top, max_delta_e, min_weight)
+        return {"results": [{"key": key, "delta_e": de, "weight": w} for key, de, w in results]}
+
+
+def parse_search(values):
+    try:
+        top = int(values.get("top", 10))
+        max_delta_e = float(values["max_delta_e"]) if values.get("max_delta_e") else None
+        min_weight = float(values.get("min_weight", 0))
+    except ValueError as e:
+        raise BadRequest(f"参数格式错误：{e}")
+    if not 1 <= top <= MAX_SEARCH_TOP:
+        raise BadRequest(f"top 只支持 1～{MAX_SEARCH_TOP}")
+    return top, max_delta_e, min_weight
+
+
+async def handle(request, job, suffix=None, archive=False):
+    try:
+        # 已经满载时不再接收上传内容，尽早拒绝
+        if pool.full():
+            raise Busy()
+        start = time.perf_counter()
+        data, params = await read_upload(request)
+        result = await pool.run(job, data, params)
+        startup.first_request((time.perf_counter() - start) * 1000)
+    except BadRequest as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
+    except Busy:
+        return JSONResponse({"error": "服务繁忙，请稍后重试"}, status_code=503, headers={"Retry-After": "1"})
+    except guardrails.LimitExceeded as e:
+        headers = {"Retry-After": "1"} if isinstance(e, guardrails.Busy) else None
+        return JSONResponse({"error": str(e)}, status_code=e.status_code, headers=headers)
+    if archive:
+        return Response(result, media_type="application/zip", headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(params['name'] + '_palettes.zip')}",
+        })
+    if suffix is None:
+        return JSONResponse(result)
+    spec = OUTPUT_FORMATS[params["format"]]
+    download_name = quote(f"{params['name']}_{suffix(params)}.{spec['ext']}")
+    return Response(result, media_type=spec["mime"], headers={
+        "Content-Disposition": f"inline; filename*=UTF-8''{download_name}",
+    })
+
+
+async def palette_endpoint(request):
+    return await handle(request, palette_job)
+
+
+async def card_endpoint(request):
+    return await handle(request, card_job, suffix=lambda params: "palette")
+
+
+async def wallpaper_endpoint(request):
+    return await handle(request, wallpaper_job, suffix=lambda params: "palette_" + (
+        "%dx%d" % params["device"] if params["device"] else orientation(params["ratio"])))
+
+
+async def variants_endpoint(request):
+    return await handle(request, variants_job, archive=True)
+
+
+async def search_endpoint(request):
+    if get_index() is None:
+        return JSONResponse({"error": "未配置色板索引（PALETTE_INDEX）"}, status_code=404)
+    try:
+        top, max_delta_e, min_weight = parse_search(request.query_params)
+    except BadRequest as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
+    if request.method == "POST":
+        return await handle(request, partial(search_palette_job, top=top))
+    try:
+        color = hex_to_rgb(request.query_params.get("color", ""))
+    except ValueError:
+        return JSONResponse({"error": "color 应为 #RRGGBB"}, status_code=400)
+    try:
+        result = await pool.run(search_color_job, color, top, max_delta_e, min_weight)
+    except Busy:
+        return JSONResponse({"error": "服务繁忙，请稍后重试"}, status_code=503, headers={"Retry-After": "1"})
+    return JSONResponse(result)
+
+
+async def clip_endpoint(request):
+    try:
+        every, keyframes = parse_clip(request.query_params)
+    except BadRequest as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
+    return await handle(request, partial(clip_job, every=every, keyframes=keyframes))
+
+
+async def clip_strip_endpoint(request):
+    try:
+        every, keyframes = parse_clip(request.query_params)
+    except BadRequest as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status_code)
+    return await handle(request, partial(clip_job, every=every, keyframes=keyframes, strip=True),
+                        suffix=lambda params: "scenes")
+
+
+async def health(request):
+    return JSONResponse({"status": "ok", "pending": pool.pending, "max_pending": pool.max_pending,
+                         "limits": guardrails.gate.stats(), "startup": startup.stats()})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    timing.configure_logging()
+    startup.start("api", import_started)
+    yield
+    pool.shutdown()
+
+
+app = Starlette(
+    routes=[
+        Route("/palette", palette_endpoint, methods=["POST"]),
+        Route("/card", card_endpoint, methods=["POST"]),
+        Route("/wallpaper", wallpaper_endpoint, methods=["POST"]),
+        Route("/variants", variants_endpoint, methods=["POST"]),
+        Route("/search", search_endpoint, methods=["GET", "POST"]),
+        Route("/clip", clip_endpoint, methods=["POST"]),
+        Route("/clip/strip", clip_strip_endpoint, methods=["POST"]),
+        Route("/health", health, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
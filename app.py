@@ -1,246 +1,406 @@
+import time
+import_started = time.perf_counter()  # 模块导入计时的起点（见 startup.py）
 import streamlit as st
-from PIL import Image, ImageDraw, ImageOps
-import numpy as np
-from sklearn.cluster import KMeans
-import tempfile
 import os
+import hashlib
+from collections import OrderedDict
+from functools import partial
+import guardrails
+import progressive
+import startup
+import timing
+from decode import DecodedUpload
+from frames import ANIMATED_EXTS, VIDEO_EXTS, extract_clip_palettes, iter_frames, probe, render_scene_strip, video_supported
+from encoders import OUTPUT_FORMATS, available_formats, encode_image, with_extension
+from palette_cache import get_cache
+from result_store import cached_bytes, get_store
+from layout import DEVICE_RESOLUTIONS, MAX_COLORS, MIN_COLORS, WALLPAPER_RATIOS, orientation
+from palette_image import (
+    center_crop_to_square, encode_png, hex_to_rgb, make_palette_image, make_wallpaper, palette_hierarchy,
+    quick_palette, render_palette_card, wallpaper_file_name,
+)
+from swatches import SHAPES
+from variants import build_zip, render_bytes, render_variants
 
-# 1. 主色提取
-def extract_colors(image, num_colors=5):
-    img = image.convert("RGB").resize((200, 200))
-    arr = np.array(img).reshape(-1, 3)
-    kmeans = KMeans(n_clusters=num_colors, random_state=42).fit(arr)
-    labels = kmeans.labels_
-    counts = np.bincount(labels)
-    order = np.argsort(-counts)
-    colors = kmeans.cluster_centers_[order].astype(int)
-    return [tuple(c) for c in colors]
-
-def hex_to_rgb(hexstr):
-    hexstr = hexstr.strip().lstrip('#')
-    return tuple(int(hexstr[i:i+2], 16) for i in (0, 2, 4))
-
-def center_crop_to_square(img):
-    w, h = img.size
-    short_side = min(w, h)
-    left = (w - short_side) // 2
-    top = (h - short_side) // 2
-    right = left + short_side
-    bottom = top + short_side
-    return img.crop((left, top, right, bottom))
-
-def add_border(img, border=40, color=(245,245,245)):
-    return ImageOps.expand(img, border=border, fill=color)
-
-def pad_to_ratio(img, ratio=(16,9), color=(245,245,245)):
-    w, h = img.size
-    target_w = w
-    target_h = int(w * ratio[1] / ratio[0])
-    if target_h < h:
-        target_h = h
-        target_w = int(h * ratio[0] / ratio[1])
-    pad_left = (target_w - w) // 2
-    pad_top = (target_h - h) // 2
-    padded_img = ImageOps.expand(img, border=(pad_left, pad_top, target_w - w - pad_left, target_h - h - pad_top), fill=color)
-    return padded_img
-
-def make_palette_image(img, bg_color, origin_name, num_colors=5, wide_palette=False, shape="方形"):
-    img = center_crop_to_square(img)
-    w, h = img.size
-
-    # 主色提取
-    if num_colors == 5 and wide_palette:
-        all_colors = extract_colors(img, 10)
-        palette = [all_colors[i] for i in [0,2,4,7,9]]
-    else:
-        palette = extract_colors(img, num_colors)
-    if num_colors == 5:
-        n_per_row, n_rows = 5, 1
-    elif num_colors == 8:
-        n_per_row, n_rows = 4, 2
-    elif num_colors == 10:
-        n_per_row, n_rows = 5, 2
+timing.configure_logging()
+startup.start("app", import_started)
+
+@st.cache_resource
+def load_banner():
+    # 横幅图片只在进程内读一次，之后每次 rerun 直接用内存里的字节
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "banner.jpeg"), "rb") as f:
+        return f.read()
+
+def decode_upload(uploaded_file):
+    # 同一个上传文件只解码一次，rerun 时直接复用
+    key = getattr(uploaded_file, "file_id", None) or uploaded_file.name
+    cached = st.session_state.get("decoded_upload")
+    if cached is None or cached[0] != key:
+        cached = (key, DecodedUpload(uploaded_file))
+        st.session_state["decoded_upload"] = cached
+    return cached[1]
+
+# 预览只用解码时的小图渲染；下载时才按所选尺寸从原图渲染
+PREVIEW_EDGE = 1000
+# 渐进模式：聚类结果不在缓存里时，先显示粗略色板的小图，细化结果在后台线程中生成，
+# 每 REFINE_POLL 秒检查一次，完成后整页 rerun 换上
+COARSE_EDGE = 480
+REFINE_POLL = 0.2
+EXPORT_EDGES = {"2048px": 2048, "4096px": 4096, "原图尺寸": None}
+COLOR_SPACES = {"sRGB": "rgb", "OKLab（感知均匀）": "oklab", "CIELAB": "lab"}
+MERGE_DELTA_E = 8
+
+def upload_job(upload, full=True, extra=0):
+    # 按原图尺寸估计内存占用（extra 为解码之外的额外占用），排队进入任务（见 guardrails.py）；
+    # 不再读文件头，后台线程里也能安全使用
+    return guardrails.job(guardrails.estimate_bytes(upload.size, upload.format, full) + extra)
+
+def preview_palette_image(upload, origin_name, card_opts):
+    return make_palette_image(
+        upload.proxy, card_opts["bg_color"], origin_name, max_edge=PREVIEW_EDGE,
+        **{k: v for k, v in card_opts.items() if k != "bg_color"}
+    )
+
+def refine_preview(upload, origin_name, card_opts):
+    # 在 progressive 的线程池中执行，不能调用任何 st.*；被取消时在 checkpoint 处抛出 Cancelled
+    with timing.trace("refine_preview", width=upload.size[0], height=upload.size[1]), upload_job(upload, full=False):
+        return preview_palette_image(upload, origin_name, card_opts)
+
+def coarse_preview(upload, origin_name, card_opts):
+    # 几千个采样点的粗略色板 + 小尺寸色板图，细化完成前先给用户看
+    palette = quick_palette(center_crop_to_square(upload.proxy), card_opts["num_colors"], card_opts["space"])
+    with timing.stage("render"):
+        img = render_palette_card(upload.proxy, palette, card_opts["bg_color"], num_colors=card_opts["num_colors"],
+                                  shape=card_opts["shape"], max_edge=COARSE_EDGE)
+    # 粗略预览只显示一会儿，用 JPEG 编码，比 PNG 快得多
+    with timing.stage("encode"):
+        data = encode_image(img, "jpeg")[0]
+    return data, f"{origin_name}_palette.png", palette, img
+
+def palette_preview(upload, origin_name, card_opts):
+    # 返回 (png 字节, 文件名, 色板, 色板图, 是否已是细化结果)
+    key = (id(upload), origin_name, tuple(card_opts.items()))
+    job = st.session_state.get("refine_job")
+    if job is not None and job.key == key and job.done():
+        if job.future.exception() is not None:
+            # 失败（如服务繁忙）的任务不保留，下次 rerun 重新提交；本次照常抛出给页面提示
+            del st.session_state["refine_job"]
+        return (*job.result(), True)
+    source = center_crop_to_square(upload.proxy)
+    if palette_hierarchy(source, "kmeans", card_opts["space"], card_opts["merge_delta_e"], cached_only=True):
+        # 已聚类过（切换形状、边框色、取色数量等）时直接同步渲染，几十毫秒内完成
+        if job is not None:
+            job.cancel()
+            del st.session_state["refine_job"]
+        return (*preview_palette_image(upload, origin_name, card_opts), True)
+    st.session_state["refine_job"] = progressive.replace(job, key, refine_preview, upload, origin_name, card_opts)
+    timing.note(progressive="coarse")
+    return (*coarse_preview(upload, origin_name, card_opts), False)
+
+def clip_palettes(uploaded_file, num_colors, space, every, keyframes):
+    # 动图/视频逐帧取色较慢：同一文件、同样的取色参数只算一次；形状、边框色只影响下面的渲染
+    key = (getattr(uploaded_file, "file_id", None) or uploaded_file.name, num_colors, space, every, keyframes)
+    cached = st.session_state.get("clip_palettes")
+    if cached is None or cached[0] != key:
+        _, size, _ = probe(uploaded_file)
+        # 任一时刻只解码一帧，按单帧估计内存（见 frames.py）
+        with guardrails.job(guardrails.estimate_bytes(size, full=False)):
+            cached = (key, *extract_clip_palettes(iter_frames(uploaded_file, every, keyframes), num_colors, space))
+        st.session_state["clip_palettes"] = cached
+    return cached[1:]
+
+def export_strip_file(strip, fmt):
+    with timing.trace("export_clip_strip", format=fmt, width=strip.size[0], height=strip.size[1]):
+        return encode_image(strip, fmt)[0]
+
+def is_clip(uploaded_file):
+    # 多帧的 GIF/WebP/PNG 或视频走逐帧取色；无法识别的文件交给下面的单张图片流程报错
+    try:
+        return probe(uploaded_file)[2]
+    except (OSError, guardrails.LimitExceeded):
+        return False
+
+def wait_for_refine(job):
+    # 以 st.fragment(run_every=REFINE_POLL) 运行：只重跑这一小段，细化完成后整页 rerun
+    if job.done():
+        st.rerun()
+    st.caption("正在细化色板……")
+
+def export_palette_image(upload, card_opts, max_edge):
+    return make_palette_image(
+        upload.full(), card_opts["bg_color"], "", palette_source=upload.proxy, max_edge=max_edge,
+        **{k: v for k, v in card_opts.items() if k != "bg_color"}
+    )[3]
+
+def export_palette_file(upload, card_opts, max_edge, fmt):
+    # 下载回调在单独的线程里执行，单独记一条计时日志
+    with timing.trace("export_card", format=fmt, max_edge=max_edge, width=upload.size[0], height=upload.size[1]):
+        def render():
+            # 全分辨率渲染要排队占用内存预算（见 guardrails.py）
+            with upload_job(upload):
+                card = export_palette_image(upload, card_opts, max_edge)
+                with timing.stage("export_encode"):
+                    return encode_image(card, fmt)[0]
+        # 其他会话/进程导出过同一张图、同样参数时直接取共享结果库里的字节
+        return cached_bytes(("card", upload.digest(), card_opts, max_edge, fmt), render)
+
+def export_wallpaper_file(upload, card_opts, max_edge, ratio, color, fmt, device=None):
+    with timing.trace("export_wallpaper", format=fmt, max_edge=max_edge, ratio=list(ratio), device=device,
+                      width=upload.size[0], height=upload.size[1]):
+        def render():
+            # 壁纸画布（原图尺寸时可达数百 MB）与色板图一起计入内存预算
+            outputs = render_bytes(upload.size, card_opts["num_colors"], shapes=(card_opts["shape"],),
+                                   bg_colors={"": card_opts["bg_color"]}, wallpapers=[(ratio, device)], max_edge=max_edge)
+            with upload_job(upload, extra=outputs):
+                wallpaper = make_wallpaper(export_palette_image(upload, card_opts, max_edge), ratio=ratio,
+                                           color=color, device=device)
+                with timing.stage("export_encode"):
+                    return encode_image(wallpaper, fmt)[0]
+        return cached_bytes(("wallpaper", upload.digest(), card_opts, max_edge, ratio, color, device, fmt), render)
+
+def export_variants_zip(upload, card_opts, max_edge, fmt, origin_name):
+    # 形状 × 边框色 × 桌面/手机 全部组合，解码和聚类只做一次
+    with timing.trace("export_variants", format=fmt, max_edge=max_edge, width=upload.size[0], height=upload.size[1]):
+        opts = {k: v for k, v in card_opts.items() if k not in ("bg_color", "shape")}
+        def render():
+            with upload_job(upload, extra=render_bytes(upload.size, opts["num_colors"], max_edge=max_edge)):
+                files = render_variants(upload, origin_name, max_edge=max_edge, fmt=fmt, **opts)
+            with timing.stage("zip"):
+                return build_zip(files)
+        return cached_bytes(("variants", upload.digest(), opts, max_edge, fmt, origin_name), render)
+
+# 最近生成过的几张壁纸预览，切换桌面/手机或填充色时直接复用
+WALLPAPER_MEMO_SIZE = 4
+
+def preview_wallpaper(card_png, palette_img, ratio, color):
+    key = (hashlib.blake2b(card_png, digest_size=16).hexdigest(), ratio, tuple(color))
+    memo = st.session_state.setdefault("wallpaper_memo", OrderedDict())
+    timing.note(wallpaper_memo="hit" if key in memo else "miss")
+    if key in memo:
+        memo.move_to_end(key)
     else:
-        raise ValueError("只支持5、8、10色")
-    border = max(24, w // 25)
-    cell_gap = max(14, w // 30)
-    gap = cell_gap
-    cell_size = (w - (n_per_row - 1) * cell_gap) // n_per_row
-    palette_h = n_rows * cell_size + (n_rows - 1) * cell_gap
-    new_w = w + 2 * border
-    new_h = h + gap + palette_h + 2 * border
-    new_img = Image.new('RGB', (new_w, new_h), bg_color)
-    new_img.paste(img, (border, border))
-    draw = ImageDraw.Draw(new_img)
-    idx = 0
-    for row in range(n_rows):
-        n_this_row = n_per_row
-        start_x = border
-        y = border + h + gap + row * (cell_size + cell_gap)
-        for i in range(n_this_row):
-            if idx >= len(palette):
-                break
-            x = start_x + i * (cell_size + cell_gap)
-            if shape == "圆形":
-                draw.ellipse([x, y, x + cell_size, y + cell_size], fill=palette[idx])
-            else:
-                draw.rectangle([x, y, x + cell_size, y + cell_size], fill=palette[idx])
-            idx += 1
-    palette_name = origin_name + "_palette.png"
-    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as out_tmp:
-        out_path = out_tmp.name
-        new_img.save(out_path)
-    return out_path, palette_name, palette, new_img
+        wallpaper_img = make_wallpaper(palette_img, ratio=ratio, color=color)
+        with timing.stage("wallpaper_encode"):
+            memo[key] = (encode_png(wallpaper_img), wallpaper_img.size)
+        while len(memo) > WALLPAPER_MEMO_SIZE:
+            memo.popitem(last=False)
+    return memo[key]
+
+def debug_enabled():
+    # 地址栏加 ?debug=1 或设置 PALETTE_DEBUG=1 时显示性能调试面板
+    return st.query_params.get("debug") == "1" or os.environ.get("PALETTE_DEBUG") == "1"
 
 # ========================== Streamlit 页面布局 ==========================
 st.set_page_config(page_title="图片色板生成工具", layout="centered")
-st.image("banner.jpeg", use_container_width=True)
-st.title("图片色板生成工具")
-st.write("上传图片，将自动生成色板。")
-
-# 1. 上传控件单独一行
-uploaded_file = st.file_uploader("上传图片", type=["png", "jpg", "jpeg"])
-
-# 2. 参数区 和 结果区 并排 1:2
-col_settings, col_result = st.columns([1, 2])
-
-with col_settings:
-    num_colors = st.radio("取色数量", options=[5, 10], index=0, horizontal=True)
-    wide_palette = False
-    if num_colors == 5:
-        pick_mode = st.radio("取色范围", ["窄", "宽"], index=0, horizontal=True, help="只在取色数量为5时可用")
-        wide_palette = (pick_mode == "宽")
-    shape = st.radio("色块形状", ["方形", "圆形"], index=0, horizontal=True)
-    color_options = {"白色": "#F5F5F5", "黑色": "#1C1C1C"}
-    color_label = st.radio("选择边框色", list(color_options.keys()), index=0, horizontal=True)
-    bg_color = hex_to_rgb(color_options[color_label])
-
-with col_result:
-    if uploaded_file is not None:
-        try:
-            origin_name = os.path.splitext(uploaded_file.name)[0]
-            img = Image.open(uploaded_file)
-            with st.spinner("正在生成色板，请稍候……"):
-                out_path, palette_name, palette, palette_img = make_palette_image(
-                    img, bg_color, origin_name, num_colors=num_colors,
-                    wide_palette=wide_palette, shape=shape
-                )
-            st.image(out_path, caption="色板拼接图", use_container_width=True)
-            with open(out_path, "rb") as f:
-                img_bytes = f.read()
-            colA, colB, colC = st.columns(3)
-            with colA:
+# 整页在一个 Trace 里运行：页面抛出异常或被 st.rerun/st.stop 中断时也会输出计时日志
+with timing.trace("page_run") as run_trace:
+    st.image(load_banner(), use_container_width=True)
+    st.title("图片色板生成工具")
+    st.write("上传图片，将自动生成色板。")
+
+    # 1. 上传控件单独一行
+    # 动图（GIF/WebP/APNG）与视频（需安装 PyAV）输出各场景的色板
+    upload_types = ["jpg", "jpeg"] + [ext[1:] for ext in ANIMATED_EXTS + (VIDEO_EXTS if video_supported() else ())]
+    uploaded_file = st.file_uploader("上传图片", type=upload_types)
+    clip = uploaded_file is not None and is_clip(uploaded_file)
+
+    # 2. 参数区 和 结果区 并排 1:2
+    col_settings, col_result = st.columns([1, 2])
+
+    with col_settings:
+        num_colors = st.slider("取色数量", min_value=MIN_COLORS, max_value=MAX_COLORS, value=5)
+        wide_palette = False
+        if num_colors == 5:
+            pick_mode = st.radio("取色范围", ["窄", "宽"], index=0, horizontal=True, help="只在取色数量为5时可用")
+            wide_palette = (pick_mode == "宽")
+        shape = st.radio("色块形状", list(SHAPES), index=0, horizontal=True)
+        color_options = {"白色": "#F5F5F5", "黑色": "#1C1C1C"}
+        color_label = st.radio("选择边框色", list(color_options.keys()), index=0, horizontal=True)
+        bg_color = hex_to_rgb(color_options[color_label])
+        space_label = st.selectbox("色彩空间", list(COLOR_SPACES), index=0, help="在感知均匀的色彩空间中取色，少量颜色也更有区分度")
+        merge_similar = st.checkbox("合并相近颜色", value=False, help=f"色差 ΔE 小于 {MERGE_DELTA_E} 的颜色视为同一种")
+        card_opts = dict(
+            bg_color=bg_color, num_colors=num_colors, wide_palette=wide_palette, shape=shape,
+            space=COLOR_SPACES[space_label], merge_delta_e=MERGE_DELTA_E if merge_similar else None,
+        )
+        export_label = st.selectbox("导出尺寸", list(EXPORT_EDGES), index=0, help="下载时按此最长边从原图渲染")
+        export_edge = EXPORT_EDGES[export_label]
+        export_format = st.selectbox(
+            "下载格式", available_formats(), index=0,
+            format_func=lambda fmt: OUTPUT_FORMATS[fmt]["label"],
+            help="PNG/WebP 无损不损失画质；WebP/JPEG 体积更小"
+        )
+        export_mime = OUTPUT_FORMATS[export_format]["mime"]
+
+    # 色板图成功生成后才置位；超限、繁忙或失败时下面的壁纸流程不再执行
+    card_ready = False
+
+    with col_result:
+        if clip:
+            try:
+                origin_name = os.path.splitext(uploaded_file.name)[0]
+                every = st.slider("每隔几帧取一帧", min_value=1, max_value=30, value=1)
+                keyframes = False
+                if uploaded_file.name.lower().endswith(VIDEO_EXTS):
+                    keyframes = st.checkbox("只取关键帧", value=True, help="只解码关键帧，长视频快得多")
+                with st.spinner("正在逐帧取色，请稍候……"):
+                    combined, scenes = clip_palettes(uploaded_file, num_colors, card_opts["space"], every, keyframes)
+                    strip = render_scene_strip(scenes, bg_color, num_colors=num_colors, shape=shape)
+                st.image(encode_png(strip), caption=f"各场景色板（{len(scenes)} 个场景）", use_container_width=True)
+                st.write("整段主色：" + " ".join('#%02x%02x%02x' % c for c in combined))
                 st.download_button(
-                    label="下载色板图片",
-                    data=img_bytes,
-                    file_name=palette_name,
-                    mime="image/png",
+                    label="下载场景色板",
+                    data=partial(export_strip_file, strip, export_format),
+                    file_name=with_extension(f"{origin_name}_scenes.png", export_format),
+                    mime=export_mime,
                 )
-            with colB:
-                if st.button("制作壁纸"):
-                    st.session_state["wallpaper_start"] = True
-        except Exception as e:
-            st.error(f"生成失败：{e}")
-
-# --- 壁纸生成流程 ---
-if st.session_state.get("wallpaper_start"):
-    st.header("制作壁纸")
+            except guardrails.LimitExceeded as e:
+                timing.note(error=f"{type(e).__name__}: {e}")
+                st.error(str(e))
+            except Exception as e:
+                timing.note(error=f"{type(e).__name__}: {e}")
+                st.error(f"生成失败：{e}")
+        elif uploaded_file is not None:
+            try:
+                origin_name = os.path.splitext(uploaded_file.name)[0]
+                with st.spinner("正在生成色板，请稍候……"):
+                    # 超大图片、服务繁忙或超时时抛出 guardrails.LimitExceeded，下面给出提示而不是让页面崩溃
+                    with guardrails.guarded(uploaded_file, full=False):
+                        upload = decode_upload(uploaded_file)
+                        timing.note(file=uploaded_file.name, width=upload.size[0], height=upload.size[1])
+                        png_bytes, palette_name, palette, palette_img, refined = palette_preview(
+                            upload, origin_name, card_opts)
+                st.image(png_bytes, caption="色板拼接图" if refined else "色板拼接图（粗略预览）", use_container_width=True)
+                if not refined:
+                    st.fragment(wait_for_refine, run_every=REFINE_POLL)(st.session_state["refine_job"])
+                colA, colB, colC = st.columns(3)
+                with colA:
+                    st.download_button(
+                        label="下载色板图片",
+                        data=partial(export_palette_file, upload, card_opts, export_edge, export_format),
+                        file_name=with_extension(palette_name, export_format),
+                        mime=export_mime,
+                    )
+                with colB:
+                    if st.button("制作壁纸"):
+                        st.session_state["wallpaper_start"] = True
+                with colC:
+                    st.download_button(
+                        label="下载全部组合",
+                        data=partial(export_variants_zip, upload, card_opts, export_edge, export_format, origin_name),
+                        file_name=f"{origin_name}_palettes.zip",
+                        mime="application/zip",
+                        help="方形/圆形 × 白色/黑色 × 桌面/手机，打包为 zip",
+                    )
+                card_ready = True
+            except guardrails.LimitExceeded as e:
+                timing.note(error=f"{type(e).__name__}: {e}")
+                st.error(str(e))
+            except Exception as e:
+                timing.note(error=f"{type(e).__name__}: {e}")
+                st.error(f"生成失败：{e}")
+        elif "refine_job" in st.session_state:
+            # 移除了图片：后台细化不再需要
+            st.session_state.pop("refine_job").cancel()
+
+    # --- 壁纸生成流程 ---
+    if st.session_state.get("wallpaper_start") and card_ready:
+        st.header("制作壁纸")
     
-    col_wpsettings, col_wpresult = st.columns([2, 3])
-#with col_wpsettings:
-# 1. 桌面/手机
-    client_type = st.radio("壁纸用途", ["桌面", "手机"], horizontal=True)
-    if client_type == "桌面":
-        ratio = (16, 9)
-    else:
-        ratio = (9, 19.5)
-    # 2. 色卡选择
-    palette_hex = ['#%02x%02x%02x' % c for c in palette]
-    n_colors = len(palette_hex)
-    bar_height = 36
+        col_wpsettings, col_wpresult = st.columns([2, 3])
+    #with col_wpsettings:
+    # 1. 桌面/手机
+        client_type = st.radio("壁纸用途", list(WALLPAPER_RATIOS), horizontal=True)
+        ratio = WALLPAPER_RATIOS[client_type]
+        # 可选按设备分辨率精确输出；预览只按设备的宽高比排版
+        devices = [name for name, size in DEVICE_RESOLUTIONS.items() if orientation(size) == orientation(ratio)]
+        device_label = st.selectbox("输出分辨率", ["自动（按色板图大小）"] + devices, index=0)
+        device = DEVICE_RESOLUTIONS.get(device_label)
+        if device is not None:
+            ratio = device
+        # 2. 色卡选择
+        palette_hex = ['#%02x%02x%02x' % c for c in palette]
+        n_colors = len(palette_hex)
+        bar_height = 36
     
     
-    # 标题
-    st.markdown("<div style='font-size:1.3em;font-weight:bold;margin:8px 0 6px 0;'>选择填充色</div>", unsafe_allow_html=True)
+        # 标题
+        st.markdown("<div style='font-size:1.3em;font-weight:bold;margin:8px 0 6px 0;'>选择填充色</div>", unsafe_allow_html=True)
     
-    # 1. SVG色带
-    rects = []
-    for i, color in enumerate(palette_hex):
-        w = 100 / n_colors
-        x = i * w
-        rects.append(f"<rect x='{x}' y='0' width='{w}' height='{bar_height}' fill='{color}'/>")
-    svg_code = f"""
+        # 1. SVG色带
+        rects = []
+        for i, color in enumerate(palette_hex):
+            w = 100 / n_colors
+            x = i * w
+            rects.append(f"<rect x='{x}' y='0' width='{w}' height='{bar_height}' fill='{color}'/>")
+        svg_code = f"""
     <div style='width:100%;max-width:700px;margin:18px auto 10px auto;'>
     <svg width='100%' height='{bar_height}' viewBox='0 0 100 {bar_height}' style='display:block;border-radius:13px;overflow:hidden;border:2px solid #444;' preserveAspectRatio="none">
         {''.join(rects)}
     </svg>
     </div>
-    """
-    st.markdown(svg_code, unsafe_allow_html=True)
+        """
+        st.markdown(svg_code, unsafe_allow_html=True)
     
-    # 2. 滑块
-    if num_colors == 5:
-        col_left, col_center, col_right = st.columns([1, 8, 1])
-    else:  # num_colors == 10
-        col_left, col_center, col_right = st.columns([1, 18, 1])
+        # 2. 滑块（中间一栏随颜色数加宽，让滑块刻度与色带大致对齐）
+        col_left, col_center, col_right = st.columns([1, max(2 * n_colors - 2, 4), 1])
         
-    with col_center:
-        color_idx = st.slider(
-            "",  # 无label
-            min_value=1, max_value=n_colors, value=1, label_visibility="collapsed"
-        ) - 1
+        with col_center:
+            color_idx = st.slider(
+                "",  # 无label
+                min_value=1, max_value=n_colors, value=1, label_visibility="collapsed"
+            ) - 1
     
-    # 3. 大色块预览
-    sel_color = palette[color_idx]
-    preview_code = f"""
+        # 3. 大色块预览
+        sel_color = palette[color_idx]
+        preview_code = f"""
     <div style='width:100%;max-width:700px;height:48px;
         background:{palette_hex[color_idx]};
         border-radius:13px;border:3px solid #444;margin:0px auto 0 auto;'>
     </div>
-    """
-#   st.markdown(preview_code, unsafe_allow_html=True)
-#   st.markdown("<div style='height:28px'></div>", unsafe_allow_html=True)
+        """
+    #   st.markdown(preview_code, unsafe_allow_html=True)
+    #   st.markdown("<div style='height:28px'></div>", unsafe_allow_html=True)
     
-    if st.button("生成壁纸图片", key="wall_generate"):
-        # 设置session状态，触发右侧显示
-        st.session_state["wallpaper_generated"] = True
+        if st.button("生成壁纸图片", key="wall_generate"):
+            # 设置session状态，触发右侧显示
+            st.session_state["wallpaper_generated"] = True
             
-    # 3. 生成壁纸，边框宽度和分辨率自动（按色板图大小扩展、绝不压缩）
-    palette_w, palette_h = palette_img.size
-    # 根据用户选择的壁纸比例自动放大/补边
-    if ratio[0] / ratio[1] > palette_w / palette_h:
-        # 需要补上下
-        wall_w = palette_w
-        wall_h = int(palette_w * ratio[1] / ratio[0])
-    else:
-        # 需要补左右
-        wall_h = palette_h
-        wall_w = int(palette_h * ratio[0] / ratio[1])
-        
-    border_width = min(wall_w, wall_h) // 4
-    img_to_use = palette_img
-    img_to_use = add_border(img_to_use, border=border_width, color=sel_color)
-    wallpaper_img = pad_to_ratio(img_to_use, ratio=ratio, color=sel_color)
-    # 不再resize（保持最高质量和最初分辨率）
-    
-#with col_wpresult: 
-    if st.session_state.get("wallpaper_generated"):
-        with st.spinner("正在生成壁纸，请稍候……"):
-            st.image(wallpaper_img, caption="壁纸预览", use_container_width=True)
-            tmp = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-            wallpaper_img.save(tmp.name)
+    #with col_wpresult: 
+        if st.session_state.get("wallpaper_generated"):
+            with st.spinner("正在生成壁纸，请稍候……"):
+                # 3. 点了“生成壁纸图片”之后才生成，边框宽度和分辨率自动（按色板图大小扩展、绝不压缩）
+                # 预览基于预览色板图；下载时再用导出尺寸的色板图生成
+                wallpaper_bytes, wallpaper_size = preview_wallpaper(png_bytes, palette_img, ratio, sel_color)
+                st.image(wallpaper_bytes, caption="壁纸预览", use_container_width=True)
             
-            # 获取原图名
-            origin_name = os.path.splitext(uploaded_file.name)[0]
-            # 判断横竖
-            w, h = wallpaper_img.size
-            orientation = "landscape" if w >= h else "portrait"
-            # 拼接文件名
-            wallpaper_file_name = f"{origin_name}_palette_{orientation}.png"
+                # 获取原图名
+                origin_name = os.path.splitext(uploaded_file.name)[0]
             
-            st.download_button(
-                "下载壁纸",
-                data=open(tmp.name, "rb"),
-                file_name=wallpaper_file_name,
-                mime="image/png"
-            )
\ No newline at end of file
+                st.download_button(
+                    "下载壁纸",
+                    data=partial(export_wallpaper_file, upload, card_opts, export_edge, ratio, sel_color, export_format,
+                                 device),
+                    file_name=with_extension(wallpaper_file_name(origin_name, wallpaper_size, device), export_format),
+                    mime=export_mime
+                )
+
+# --- 性能调试面板（每次 rerun 的分阶段耗时） ---
+run_record = run_trace.as_dict()
+if uploaded_file is not None:
+    # 第一次真正处理上传的运行算作首个请求
+    startup.first_request(run_record["total_ms"])
+if debug_enabled():
+    with st.expander("性能调试信息", expanded=False):
+        st.write("本次运行各阶段耗时（毫秒）")
+        st.bar_chart(run_record["stages_ms"], horizontal=True)
+        st.json(run_record)
+        st.write("色板缓存")
+        st.json(get_cache().stats())
+        st.write("资源限制")
+        st.json(guardrails.gate.stats())
+        st.write("启动与预热")
+        st.json(startup.stats())
+        if get_store() is not None:
+            st.write("共享结果库")
+            st.json(get_store().stats())
@@ -0,0 +1,50 @@
+import argparse
+import json
+import os
+import sys
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from encoders import OUTPUT_FORMATS, available_formats, compare_encoders  # noqa: E402
+from palette_image import make_palette_image, make_wallpaper  # noqa: E402
+
+# 输出格式对比：同一张色板图/壁纸在各格式下的编码耗时与体积
+#   python benchmarks/bench_encoders.py [图片] --edges 1000,2048,4096 --json
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对比输出格式的编码耗时与体积")
+    parser.add_argument("image", nargs="?", default="banner.jpeg")
+    parser.add_argument("--edges", default="1000,2048,4096", help="逗号分隔的色板图最长边")
+    parser.add_argument("--formats", default=",".join(available_formats()))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    args = parser.parse_args(argv)
+
+    src = Image.open(args.image).convert("RGB")
+    formats = [f for f in args.formats.split(",") if f]
+    results = []
+    for edge in [int(e) for e in args.edges.split(",") if e]:
+        # 小图放大到目标尺寸，模拟大图导出
+        scale = max(1.0, edge / min(src.size))
+        img = src.resize((int(src.width * scale), int(src.height * scale)))
+        card = make_palette_image(img, (245, 245, 245), "bench", max_edge=edge)[3]
+        wallpaper = make_wallpaper(card, ratio=(16, 9), color=(28, 28, 28))
+        for kind, target in (("card", card), ("wallpaper", wallpaper)):
+            for row in compare_encoders(target, formats, repeat=args.repeat):
+                row.update({"kind": kind, "edge": edge, "size": list(target.size)})
+                results.append(row)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    print(f"{'kind':<10}{'edge':>6}  {'format':<15}{'encode ms':>11}{'KiB':>10}")
+    for r in results:
+        label = OUTPUT_FORMATS[r["format"]]["label"]
+        print(f"{r['kind']:<10}{r['edge']:>6}  {r['format']:<15}{r['encode_ms']:>11.1f}{r['bytes'] / 1024:>10.1f}  {label}")
+
+
+if __name__ == "__main__":
+    main()
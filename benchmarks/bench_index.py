@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from palette_index import PaletteIndex  # noqa: E402
+
+# 色板索引的查询耗时：随机生成 N 张图片的 5 色色板写入临时索引，测色板查询与单色查询
+#   python benchmarks/bench_index.py --sizes 10000,100000,300000 --repeat 5 --json
+
+
+def build(path, size, seed=0):
+    rng = np.random.default_rng(seed)
+    index = PaletteIndex(path)
+    colors = rng.integers(0, 256, (size, 5, 3))
+    weights = rng.dirichlet(np.ones(5), size)
+    for i in range(size):
+        index.add(f"img_{i:07d}", colors[i], weights[i])
+    index.flush()
+    return index, colors, weights
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return round(float(np.median(timings)) * 1000, 2)
+
+
+def run(sizes, repeat):
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as path:
+            start = time.perf_counter()
+            index, colors, weights = build(path, size)
+            build_s = time.perf_counter() - start
+            results.append({
+                "entries": size,
+                "build_s": round(build_s, 2),
+                "mb": round(os.path.getsize(os.path.join(path, "palettes.f32")) / 2 ** 20, 1),
+                "palette_ms": timed(lambda: index.search_palette(colors[0], weights[0], 10), repeat),
+                "color_ms": timed(lambda: index.search_color((42, 111, 219), 10, min_weight=0.05), repeat),
+                "self_hit": index.search_palette(colors[1], weights[1], 1)[0][0] == "img_0000001",
+            })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="色板索引查询耗时")
+    parser.add_argument("--sizes", default="10000,100000", help="逗号分隔的索引条数")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    args = parser.parse_args(argv)
+    results = run([int(s) for s in args.sizes.split(",") if s], args.repeat)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    print(f"{'entries':>9}{'MB':>7}{'build s':>9}{'palette ms':>12}{'color ms':>10}  self_hit")
+    for r in results:
+        print(f"{r['entries']:>9}{r['mb']:>7.1f}{r['build_s']:>9.2f}{r['palette_ms']:>12.1f}{r['color_ms']:>10.1f}"
+              f"  {r['self_hit']}")
+
+
+if __name__ == "__main__":
+    main()
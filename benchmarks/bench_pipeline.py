@@ -0,0 +1,272 @@
+import argparse
+import ctypes
+import gc
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 基准测试不读写磁盘缓存
+os.environ.pop("PALETTE_CACHE_DIR", None)
+
+from decode import DecodedUpload  # noqa: E402
+from encoders import encode_image  # noqa: E402
+from palette_cache import get_cache  # noqa: E402
+from palette_image import (  # noqa: E402
+    add_border, center_crop_to_square, make_palette_image, make_wallpaper, pad_to_ratio,
+)
+from quantize import extract_colors, warm_up  # noqa: E402
+from swatches import SHAPES  # noqa: E402
+
+# 色板流水线各阶段的基准测试：解码 → 裁剪 → 取色 → 拼色板图 → 壁纸 → 编码
+#   python benchmarks/bench_pipeline.py --sizes 1,12,50 --repeat 5 --out run.json
+#   python benchmarks/bench_pipeline.py --baseline run.json   # 与上次结果比较，变慢或内存增长超过阈值时返回非 0
+# 每个阶段报告耗时分位数（毫秒）、峰值内存和输出字节数，结果为 JSON。
+# 峰值内存有两项：alloc_peak_mb 为 tracemalloc 看到的 Python/NumPy 分配峰值；
+# rss_peak_mb 为阶段运行期间常驻内存相对运行前的最大增量（后台线程每 RSS_SAMPLE_S 秒采样一次），
+# Pillow 在 C 层分配的图像缓冲只有这一项看得到。采样需要 /proc（Linux），其他平台为 null。
+
+COMBOS = [(5, False), (5, True), (10, False), (24, False)]
+RSS_SAMPLE_S = 0.001
+# 内存比上次多出不到这么多时不算回退，避免小阶段的采样噪声
+MEM_FLOOR_MB = 2.0
+
+
+def synthetic_jpeg(megapixels, seed=0):
+    # 低分辨率随机色块放大后加噪声，近似照片的颜色分布；4:3 画幅
+    rng = np.random.default_rng(seed)
+    h = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    w = int(h * 4 / 3)
+    base = Image.fromarray(rng.integers(0, 256, (12, 16, 3), dtype=np.uint8)).resize((w, h), Image.BICUBIC)
+    noise = Image.effect_noise((w, h), 24).convert("RGB")
+    img = Image.blend(base, noise, 0.15)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def load_sample(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def max_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 为 KiB，macOS 为字节
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def current_rss():
+    # 当前常驻内存（字节）；没有 /proc 时返回 None
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return None
+
+
+def release_memory():
+    # 让上一阶段释放的内存真正还给系统，本阶段的 RSS 增量才不会被已有的空闲堆吸收
+    gc.collect()
+    if sys.platform.startswith("linux"):
+        try:
+            ctypes.CDLL("libc.so.6").malloc_trim(0)
+        except OSError:
+            pass
+
+
+class RssSampler:
+    # with 块内在后台线程里轮询 RSS，peak 为相对进入时的最大增量（字节）
+    def __init__(self, interval=RSS_SAMPLE_S):
+        self.interval = interval
+        self.peak = None
+
+    def _poll(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss() - self.base)
+
+    def __enter__(self):
+        self.base = current_rss()
+        if self.base is not None:
+            self.peak = 0
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._poll, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.base is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, current_rss() - self.base)
+
+
+def mb(nbytes):
+    return None if nbytes is None else round(nbytes / 2 ** 20, 2)
+
+
+def measure(fn, repeat):
+    # 第一次运行记录内存（tracemalloc 峰值 + RSS 采样），之后的运行只计时
+    release_memory()
+    with RssSampler() as rss:
+        tracemalloc.start()
+        result = fn()
+        alloc_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    stats = {
+        "p50_ms": round(float(np.percentile(timings, 50)), 3),
+        "p90_ms": round(float(np.percentile(timings, 90)), 3),
+        "p99_ms": round(float(np.percentile(timings, 99)), 3),
+        "max_ms": round(max(timings), 3),
+        "alloc_peak_mb": mb(alloc_peak),
+        "rss_peak_mb": mb(rss.peak),
+    }
+    return result, stats
+
+
+def uncached(fn):
+    def run():
+        get_cache().clear()
+        return fn()
+    return run
+
+
+def bench_image(name, data, repeat):
+    rows = []
+
+    def record(stage, fn, **params):
+        result, stats = measure(fn, repeat)
+        out_bytes = len(result) if isinstance(result, bytes) else None
+        if isinstance(result, tuple) and isinstance(result[0], bytes):
+            out_bytes = len(result[0])
+        rows.append(dict(image=name, stage=stage, params=params, output_bytes=out_bytes, **stats))
+        return result
+
+    upload = record("decode_proxy", lambda: DecodedUpload(io.BytesIO(data)))
+    full = record("decode_full", lambda: DecodedUpload(io.BytesIO(data)).full())
+    square = record("center_crop_to_square", lambda: center_crop_to_square(full))
+    proxy_square = center_crop_to_square(upload.proxy)
+    for num_colors in (5, 10):
+        record("extract_colors", lambda: extract_colors(proxy_square, num_colors),
+               num_colors=num_colors)
+
+    for num_colors, wide in COMBOS:
+        for shape in SHAPES:
+            params = dict(num_colors=num_colors, wide_palette=wide, shape=shape)
+            record("make_palette_image_preview", uncached(lambda: make_palette_image(
+                upload.proxy, (245, 245, 245), name, num_colors=num_colors, wide_palette=wide,
+                shape=shape, max_edge=1000)), **params)
+            card = record("make_palette_image_export", uncached(lambda: make_palette_image(
+                square, (245, 245, 245), name, num_colors=num_colors, wide_palette=wide,
+                shape=shape, palette_source=upload.proxy)), **params)[3]
+
+    for ratio in ((16, 9), (9, 19.5)):
+        params = dict(ratio=list(ratio))
+        bordered = record("add_border", lambda: add_border(card, border=min(card.size) // 4), **params)
+        record("pad_to_ratio", lambda: pad_to_ratio(bordered, ratio=ratio), **params)
+        wallpaper = record("make_wallpaper", lambda: make_wallpaper(card, ratio=ratio), **params)
+        record("encode_wallpaper_png", lambda: encode_image(wallpaper, "png"), **params)
+    record("encode_card_png", lambda: encode_image(card, "png"))
+    megapixels = round(full.width * full.height / 1e6, 2)
+    for row in rows:
+        row["megapixels"] = megapixels
+    return rows
+
+
+def row_key(row):
+    return (row["image"], row["stage"], json.dumps(row["params"], sort_keys=True, ensure_ascii=False))
+
+
+def regressed(metric, new, old, threshold):
+    if new is None or old is None:
+        return False
+    if metric.endswith("_mb"):
+        return new > old * (1 + threshold) and new - old >= MEM_FLOOR_MB
+    return old > 0 and new > old * (1 + threshold)
+
+
+def compare(results, baseline, threshold, mem_threshold):
+    # 耗时看 p50，内存看两项峰值；各自超过阈值都算回退
+    old = {row_key(r): r for r in baseline["results"]}
+    regressions = []
+    for row in results:
+        prev = old.get(row_key(row))
+        if not prev:
+            continue
+        for metric, limit in (("p50_ms", threshold), ("alloc_peak_mb", mem_threshold),
+                              ("rss_peak_mb", mem_threshold)):
+            if regressed(metric, row.get(metric), prev.get(metric), limit):
+                regressions.append({
+                    "image": row["image"], "stage": row["stage"], "params": row["params"], "metric": metric,
+                    "baseline": prev[metric], "current": row[metric],
+                    "ratio": round(row[metric] / prev[metric], 2) if prev[metric] else None,
+                })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="色板流水线分阶段基准测试")
+    parser.add_argument("images", nargs="*", help="额外的样例图片")
+    parser.add_argument("--sizes", default="1,12,24,50", help="逗号分隔的合成图百万像素数")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", help="JSON 结果写入文件（默认打印到标准输出）")
+    parser.add_argument("--baseline", help="上次的 JSON 结果，用于检查性能回退")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p50 变慢超过该比例视为回退")
+    parser.add_argument("--mem-threshold", type=float, default=0.2,
+                        help=f"峰值内存增长超过该比例（且至少 {MEM_FLOOR_MB:g} MB）视为回退")
+    args = parser.parse_args(argv)
+
+    inputs = [(f"synthetic_{mp}mp", synthetic_jpeg(float(mp))) for mp in args.sizes.split(",") if mp]
+    inputs += [(os.path.basename(path), load_sample(path)) for path in args.images]
+
+    # sklearn 按需导入（见 quantize._kmeans_centers），先导入完，免得算进第一个取色阶段的耗时和内存
+    warm_up()
+    results = []
+    for name, data in inputs:
+        print(f"benchmarking {name} ...", file=sys.stderr)
+        results.extend(bench_image(name, data, args.repeat))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pillow": Image.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+            "max_rss_mb": round(max_rss_mb(), 1),
+        },
+        "results": results,
+    }
+    status = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["regressions"] = compare(results, json.load(f), args.threshold, args.mem_threshold)
+        status = 1 if report["regressions"] else 0
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
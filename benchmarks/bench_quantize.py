@@ -0,0 +1,95 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from colorspace import delta_e, srgb_to_lab  # noqa: E402
+from quantize import QUANTIZERS, SAMPLERS, extract_colors, sample_pixels, warm_up  # noqa: E402
+
+# 取色引擎对比：各后端的耗时与色板质量
+# 质量指标：采样像素到最近色板颜色的平均 ΔE（CIE76），越小越好
+#   python benchmarks/bench_quantize.py [图片 ...] --repeat 5 --json
+#   python benchmarks/bench_quantize.py --sampling stride,random,stratified --no-early-stop
+
+
+def synthetic_images():
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:800, 0:1200]
+    gradient = np.stack([xx * 255 / 1200, yy * 255 / 800, (xx + yy) * 255 / 2000], axis=-1)
+    blocks = np.kron(rng.integers(0, 256, (8, 12, 3)), np.ones((100, 100, 1)))
+    noisy = np.clip(blocks + rng.normal(0, 18, blocks.shape), 0, 255)
+    return {
+        "gradient": Image.fromarray(gradient.astype(np.uint8)),
+        "blocks_noise": Image.fromarray(noisy.astype(np.uint8)),
+    }
+
+
+def mean_delta_e(image, palette):
+    pixels = srgb_to_lab(sample_pixels(image))
+    centers = srgb_to_lab(np.array(palette))
+    dist = delta_e(pixels[:, None, :], centers[None, :, :])
+    return float(dist.min(axis=1).mean())
+
+
+def run(images, methods, counts, repeat, samplings=("stride",), early_stop=True):
+    # sklearn 按需导入（见 quantize._kmeans_centers），先导入完并让各后端各跑一次，免得算进第一行的耗时
+    warm_up(methods)
+    results = []
+    for name, image in images.items():
+        for num_colors in counts:
+            for method, sampling in itertools.product(methods, samplings):
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    palette = extract_colors(image, num_colors, method=method, sampling=sampling,
+                                             early_stop=early_stop)
+                    timings.append(time.perf_counter() - start)
+                results.append({
+                    "image": name,
+                    "num_colors": num_colors,
+                    "method": method,
+                    "sampling": sampling,
+                    "median_ms": round(float(np.median(timings)) * 1000, 2),
+                    "min_ms": round(min(timings) * 1000, 2),
+                    "mean_delta_e": round(mean_delta_e(image, palette), 3),
+                })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对比取色后端的速度与质量")
+    parser.add_argument("images", nargs="*", help="额外的测试图片")
+    parser.add_argument("--methods", default=",".join(QUANTIZERS), help="逗号分隔的后端名")
+    parser.add_argument("--counts", default="5,10", help="逗号分隔的取色数量")
+    parser.add_argument("--sampling", default="stride", help=f"逗号分隔的采样方式：{', '.join(SAMPLERS)}")
+    parser.add_argument("--no-early-stop", action="store_true", help="关闭逐级加大样本的提前结束")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    args = parser.parse_args(argv)
+
+    images = synthetic_images()
+    for path in args.images:
+        images[os.path.basename(path)] = Image.open(path)
+    methods = [m for m in args.methods.split(",") if m]
+    counts = [int(c) for c in args.counts.split(",") if c]
+    samplings = [m for m in args.sampling.split(",") if m]
+    results = run(images, methods, counts, args.repeat, samplings, not args.no_early_stop)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    print(f"{'image':<16}{'k':>4}  {'method':<11}{'sampling':<12}{'median ms':>11}{'min ms':>9}{'ΔE':>8}")
+    for r in results:
+        print(f"{r['image']:<16}{r['num_colors']:>4}  {r['method']:<11}{r['sampling']:<12}"
+              f"{r['median_ms']:>11.1f}{r['min_ms']:>9.1f}{r['mean_delta_e']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
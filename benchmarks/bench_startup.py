@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 冷启动耗时：每次在新的 Python 进程里导入 api，再用 TestClient 发出第一个 /palette 请求，
+# 随后用另一张图（不命中色板缓存）发第二个请求作为稳态对照
+#   python benchmarks/bench_startup.py --repeat 3 --json
+# 模式：
+#   eager       导入 api 之前先导入 sklearn（相当于模块顶层导入 sklearn 的旧做法）
+#   off         按需导入，不预热：第一个请求承担 sklearn 的导入
+#   background  按需导入，启动后后台预热；等预热结束再发请求（请求晚于预热到达的情形）
+#   sync        启动时同步预热，导入耗时之外另计 lifespan 耗时
+
+CHILD = r"""
+import io, json, sys, time
+import_started = time.perf_counter()
+if sys.argv[1] == "eager":
+    import sklearn.cluster
+import api
+import_ms = (time.perf_counter() - import_started) * 1000
+import numpy as np
+from PIL import Image
+from starlette.testclient import TestClient
+import startup
+uploads = []
+for seed in (0, 1):
+    buf = io.BytesIO()
+    Image.fromarray(np.random.default_rng(seed).integers(0, 256, (600, 800, 3), dtype=np.uint8)).save(buf, "PNG")
+    uploads.append(buf.getvalue())
+start = time.perf_counter()
+with TestClient(api.app) as client:
+    lifespan_ms = (time.perf_counter() - start) * 1000
+    startup.wait(30)
+    start = time.perf_counter()
+    client.post("/palette", files={"file": ("a.png", uploads[0])}).raise_for_status()
+    first_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    client.post("/palette", files={"file": ("b.png", uploads[1])}).raise_for_status()
+    second_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({"import_ms": import_ms, "lifespan_ms": lifespan_ms, "first_ms": first_ms,
+                  "second_ms": second_ms, "warmup_ms": startup.stats()["warmup_ms"]}))
+"""
+
+MODES = ("eager", "off", "background", "sync")
+
+
+def run_once(mode):
+    env = dict(os.environ, PALETTE_TIMING_LOG="0", PALETTE_WARMUP="off" if mode == "eager" else mode)
+    env.pop("PALETTE_STORE", None)
+    env.pop("PALETTE_CACHE_DIR", None)
+    out = subprocess.run([sys.executable, "-c", CHILD, mode], cwd=ROOT, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(modes, repeat):
+    results = []
+    for mode in modes:
+        runs = [run_once(mode) for _ in range(repeat)]
+        result = {"mode": mode}
+        for field in ("import_ms", "lifespan_ms", "first_ms", "second_ms", "warmup_ms"):
+            values = [r[field] for r in runs if r[field] is not None]
+            result[field] = round(float(np.median(values)), 1) if values else None
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="冷启动与首个请求耗时")
+    parser.add_argument("--modes", default=",".join(MODES), help="逗号分隔，可选 " + "/".join(MODES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    args = parser.parse_args(argv)
+    results = run([m for m in args.modes.split(",") if m], args.repeat)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    print(f"{'mode':>11}{'import ms':>11}{'lifespan ms':>13}{'warmup ms':>11}{'first ms':>10}{'second ms':>11}")
+    for r in results:
+        warmup = "-" if r["warmup_ms"] is None else f"{r['warmup_ms']:.1f}"
+        print(f"{r['mode']:>11}{r['import_ms']:>11.1f}{r['lifespan_ms']:>13.1f}{warmup:>11}{r['first_ms']:>10.1f}"
+              f"{r['second_ms']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import numpy as np
+
+# 颜色空间换算（全部为向量化 NumPy，输入形如 (..., 3) 的 0-255 sRGB）
+
+# D65 白点下 sRGB(linear) -> XYZ
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+_XYZ_TO_RGB = np.linalg.inv(_RGB_TO_XYZ)
+_WHITE_D65 = np.array([0.95047, 1.0, 1.08883])
+
+# OKLab（Björn Ottosson, 2020）：linear sRGB -> LMS -> Lab
+_RGB_TO_LMS = np.array([
+    [0.4122214708, 0.5363325363, 0.0514459929],
+    [0.2119034982, 0.6806995451, 0.1073969566],
+    [0.0883024619, 0.2817188376, 0.6299787005],
+])
+_LMS_TO_OKLAB = np.array([
+    [0.2104542553, 0.7936177850, -0.0040720468],
+    [1.9779984951, -2.4285922050, 0.4505937099],
+    [0.0259040371, 0.7827717662, -0.8086757660],
+])
+_LMS_TO_RGB = np.linalg.inv(_RGB_TO_LMS)
+_OKLAB_TO_LMS = np.linalg.inv(_LMS_TO_OKLAB)
+
+# 聚类可用的色彩空间；oklab 数值放大 100 倍，与 CIELAB 量级一致（ΔE 可直接比较）
+SPACES = ("rgb", "lab", "oklab")
+OKLAB_SCALE = 100.0
+
+
+def srgb_to_linear(rgb):
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(lin):
+    lin = np.clip(lin, 0.0, 1.0)
+    c = np.where(lin <= 0.0031308, lin * 12.92, 1.055 * lin ** (1 / 2.4) - 0.055)
+    return c * 255.0
+
+
+def srgb_to_lab(rgb):
+    xyz = srgb_to_linear(rgb) @ _RGB_TO_XYZ.T / _WHITE_D65
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    L = 116 * f[..., 1] - 16
+    a = 500 * (f[..., 0] - f[..., 1])
+    b = 200 * (f[..., 1] - f[..., 2])
+    return np.stack([L, a, b], axis=-1)
+
+
+def lab_to_srgb(lab):
+    lab = np.asarray(lab, dtype=np.float64)
+    fy = (lab[..., 0] + 16) / 116
+    f = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200], axis=-1)
+    xyz = np.where(f > 6 / 29, f ** 3, 3 * (6 / 29) ** 2 * (f - 4 / 29)) * _WHITE_D65
+    return linear_to_srgb(xyz @ _XYZ_TO_RGB.T)
+
+
+def srgb_to_oklab(rgb):
+    lms = np.cbrt(srgb_to_linear(rgb) @ _RGB_TO_LMS.T)
+    return lms @ _LMS_TO_OKLAB.T
+
+
+def oklab_to_srgb(lab):
+    lms = (np.asarray(lab, dtype=np.float64) @ _OKLAB_TO_LMS.T) ** 3
+    return linear_to_srgb(lms @ _LMS_TO_RGB.T)
+
+
+def to_space(rgb, space="rgb"):
+    if space == "rgb":
+        return np.asarray(rgb, dtype=np.float64)
+    if space == "lab":
+        return srgb_to_lab(rgb)
+    if space == "oklab":
+        return srgb_to_oklab(rgb) * OKLAB_SCALE
+    raise ValueError(f"未知的色彩空间：{space}")
+
+
+def from_space(values, space="rgb"):
+    # 返回 0-255 的 sRGB 浮点数组
+    if space == "rgb":
+        return np.clip(np.asarray(values, dtype=np.float64), 0, 255)
+    if space == "lab":
+        return lab_to_srgb(values)
+    if space == "oklab":
+        return oklab_to_srgb(np.asarray(values, dtype=np.float64) / OKLAB_SCALE)
+    raise ValueError(f"未知的色彩空间：{space}")
+
+
+def delta_e(lab1, lab2):
+    # CIE76：Lab 空间欧氏距离
+    return np.sqrt(((np.asarray(lab1) - np.asarray(lab2)) ** 2).sum(axis=-1))
@@ -0,0 +1,70 @@
+import hashlib
+import io
+
+from PIL import Image
+
+from guardrails import checkpoint, peek_size
+from timing import note, stage
+
+# 解码阶段：取色和预览只需要一张小图（quantize 里只再采样约 4 万个像素），
+# 所以先用 JPEG 的 draft 模式在解码时直接按 1/2、1/4、1/8 缩小，
+# 其他格式解码后用 reduce 整数倍缩小；全分辨率只在真正要用时才解码。
+# 原始字节在构造时（Streamlit 的脚本线程里）一次性取出，之后每次读取各用自己的 BytesIO：
+# 下载回调在工作线程中执行，不能与 rerun 争用上传控件的同一个文件流。
+
+PROXY_SIDE = 600
+
+
+def load_reduced(fp, min_side=None):
+    # 返回短边不小于 min_side 的 RGB 图；min_side 为 None 时完整解码
+    fp.seek(0)
+    img = Image.open(fp)
+    if min_side is not None:
+        w, h = img.size
+        scale = min(w, h) / min_side
+        if img.format == "JPEG" and scale >= 2:
+            # draft 保证结果不小于请求的尺寸
+            img.draft("RGB", (int(w / scale) + 1, int(h / scale) + 1))
+    # 已是 RGB 时 convert 会多复制一份整图，直接解码即可
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    else:
+        img.load()
+    if min_side is not None:
+        factor = min(img.size) // min_side
+        if factor >= 2:
+            img = img.reduce(factor)
+    return img
+
+
+def read_bytes(fp):
+    # UploadedFile / BytesIO 直接取底层字节，不移动流的位置
+    if hasattr(fp, "getvalue"):
+        return fp.getvalue()
+    fp.seek(0)
+    return fp.read()
+
+
+class DecodedUpload:
+    def __init__(self, fp, proxy_side=PROXY_SIDE):
+        self.data = read_bytes(fp)
+        # 只读文件头；解压炸弹等超大图片在解码前就拒绝（上限见 guardrails.py）
+        self.size, self.format = peek_size(io.BytesIO(self.data))
+        with stage("decode_proxy"):
+            self.proxy = load_reduced(io.BytesIO(self.data), proxy_side)
+        note(width=self.size[0], height=self.size[1], source_format=self.format, proxy_size=list(self.proxy.size))
+        self._digest = None
+
+    def digest(self):
+        # 原始文件字节的哈希，用作共享结果库的键：同一张图片无论谁上传都相同
+        if self._digest is None:
+            self._digest = hashlib.blake2b(self.data, digest_size=16).hexdigest()
+        return self._digest
+
+    def full(self):
+        # 每次调用都重新解码，不挂在对象上：DecodedUpload 存在会话里，缓存的全分辨率图
+        # （50 百万像素约 150 MB）会在任务结束、guardrails 释放预算后一直占着内存。
+        # 调用方在一个任务内只取一次
+        checkpoint()
+        with stage("decode_full"):
+            return load_reduced(io.BytesIO(self.data))
@@ -0,0 +1,68 @@
+import io
+import os
+import time
+
+from PIL import features
+
+# 输出编码：色板图/壁纸的下载格式
+# 色板图大面积纯色，PNG 压缩等级、WebP 无损通常比默认 PNG 又快又小；JPEG/WebP 有损适合照片占比大的大图
+
+OUTPUT_FORMATS = {
+    "png": {"label": "PNG", "ext": "png", "mime": "image/png",
+            "params": {"format": "PNG", "compress_level": 6}},
+    "png-fast": {"label": "PNG（快速）", "ext": "png", "mime": "image/png",
+                 "params": {"format": "PNG", "compress_level": 1}},
+    "png-small": {"label": "PNG（最小）", "ext": "png", "mime": "image/png",
+                  "params": {"format": "PNG", "optimize": True}},
+    "webp-lossless": {"label": "WebP 无损", "ext": "webp", "mime": "image/webp", "feature": "webp",
+                      "params": {"format": "WEBP", "lossless": True, "quality": 60, "method": 4}},
+    "webp": {"label": "WebP", "ext": "webp", "mime": "image/webp", "feature": "webp",
+             "params": {"format": "WEBP", "quality": 90, "method": 4}},
+    "avif": {"label": "AVIF", "ext": "avif", "mime": "image/avif", "feature": "avif",
+             "params": {"format": "AVIF", "quality": 80}},
+    "jpeg": {"label": "JPEG", "ext": "jpg", "mime": "image/jpeg",
+             "params": {"format": "JPEG", "quality": 92, "subsampling": 0}},
+}
+
+
+def _supported(feature):
+    if feature is None:
+        return True
+    try:
+        return bool(features.check(feature))
+    except ValueError:
+        # 旧版 Pillow 不认识该特性名
+        return False
+
+
+def available_formats():
+    return [key for key, spec in OUTPUT_FORMATS.items() if _supported(spec.get("feature"))]
+
+
+def encode_image(img, fmt="png"):
+    # 返回 (字节, 编码耗时秒)
+    spec = OUTPUT_FORMATS[fmt]
+    start = time.perf_counter()
+    buf = io.BytesIO()
+    img.save(buf, **spec["params"])
+    return buf.getvalue(), time.perf_counter() - start
+
+
+def with_extension(file_name, fmt):
+    return os.path.splitext(file_name)[0] + "." + OUTPUT_FORMATS[fmt]["ext"]
+
+
+def compare_encoders(img, formats=None, repeat=1):
+    # 各格式的编码耗时与体积，用于权衡延迟和带宽
+    report = []
+    for fmt in formats or available_formats():
+        timings = []
+        for _ in range(repeat):
+            data, seconds = encode_image(img, fmt)
+            timings.append(seconds)
+        report.append({
+            "format": fmt,
+            "encode_ms": round(min(timings) * 1000, 2),
+            "bytes": len(data),
+        })
+    return report
@@ -0,0 +1,173 @@
+import importlib.util
+import os
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image, ImageSequence, UnidentifiedImageError
+
+from colorspace import delta_e, srgb_to_lab
+from guardrails import check_pixels, checkpoint, peek_size
+from layout import card_layout
+from palette_image import center_crop_to_square, render_palette_card
+from quantize import N_CODES, StreamingPalette
+from timing import note, stage
+
+# 动图（GIF / 动态 WebP / APNG）与短视频的取色。
+# 帧由生成器逐帧解码，每隔 every 帧取一帧（视频还可只解关键帧），缩到短边约 FRAME_SIDE 后
+# 喂给同一个 quantize.StreamingPalette 增量聚类，而不是逐帧跑 extract_colors；
+# 相邻采样帧 16x16 缩略图的平均 ΔE 超过 scene_delta_e 时切分场景，各场景的色板取自同一组码字。
+# 任一时刻只持有当前帧、上一帧的缩略图和每个场景一张代表帧，内存与帧数无关；
+# 场景数上限 MAX_SCENES，之后的帧都算入最后一个场景。
+#   PALETTE_MAX_FRAMES   最多采样的帧数（默认 600），超出的部分不再解码
+
+FRAME_SIDE = 256
+THUMB_SIDE = 360
+SIGNATURE_SIDE = 16
+SCENE_DELTA_E = 18.0
+MAX_SCENES = 12
+STRIP_PER_ROW = 4
+MAX_SAMPLED_FRAMES = int(os.environ.get("PALETTE_MAX_FRAMES", 600))
+VIDEO_EXTS = (".mp4", ".mov", ".m4v", ".webm", ".mkv")
+# 可能含多帧的图片格式（PNG 即 APNG），由 probe 判断是否真的是动图
+ANIMATED_EXTS = (".gif", ".webp", ".png")
+
+Frame = namedtuple("Frame", "index time_ms image")
+Scene = namedtuple("Scene", "start_index start_ms frames palette thumbnail")
+
+
+def video_supported():
+    # 视频解码是可选依赖（pip install -r requirements-video.txt）；只查找不导入，
+    # PyAV 连同 FFmpeg 的加载推迟到真正解码视频时
+    return importlib.util.find_spec("av") is not None
+
+
+def load_av():
+    if not video_supported():
+        raise RuntimeError("解码视频需要安装 PyAV：pip install -r requirements-video.txt")
+    import av
+    return av
+
+
+def probe(fp):
+    # 返回 ("image" | "video", (宽, 高), 是否有多帧)，只读文件头。都无法识别时抛出 UnidentifiedImageError；
+    # 超过像素上限时抛出 guardrails.ImageTooLarge（peek_size 也把 Pillow 的解压炸弹错误转成它）
+    try:
+        size, _ = peek_size(fp)
+    except UnidentifiedImageError:
+        if not video_supported():
+            raise
+    else:
+        fp.seek(0)
+        with Image.open(fp) as img:
+            return "image", size, getattr(img, "is_animated", False)
+    av = load_av()
+    fp.seek(0)
+    try:
+        with av.open(fp) as container:
+            stream = container.streams.video[0]
+            size = (stream.codec_context.width, stream.codec_context.height)
+    except (av.error.FFmpegError, IndexError):
+        raise UnidentifiedImageError("无法识别的图片或视频")
+    check_pixels(size)
+    return "video", size, True
+
+
+def shrink(img, side):
+    # 整数倍缩小到短边不小于 side
+    factor = min(img.size) // side
+    return img.reduce(factor) if factor >= 2 else img
+
+
+def iter_image_frames(fp, every=1):
+    # GIF 等动图的帧依赖前一帧，必须逐帧解码；只有被采样的帧才转换成 RGB
+    fp.seek(0)
+    with Image.open(fp) as img:
+        time_ms = 0
+        for index, frame in enumerate(ImageSequence.Iterator(img)):
+            if index % every == 0:
+                yield Frame(index, time_ms, frame.convert("RGB"))
+            time_ms += frame.info.get("duration") or 0
+
+
+def iter_video_frames(fp, every=1, keyframes=False):
+    av = load_av()
+    fp.seek(0)
+    with av.open(fp) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        if keyframes:
+            # 解码器直接跳过非关键帧，省去绝大部分解码
+            stream.codec_context.skip_frame = "NONKEY"
+        for index, frame in enumerate(container.decode(stream)):
+            if index % every:
+                continue
+            # 缩放在 libswscale 里和色彩转换一起完成，不生成全分辨率的 RGB 帧
+            scale = max(min(frame.width, frame.height) / FRAME_SIDE, 1)
+            rgb = frame.reformat(width=round(frame.width / scale), height=round(frame.height / scale),
+                                 format="rgb24")
+            time_ms = round(frame.time * 1000) if frame.time is not None else None
+            yield Frame(index, time_ms, rgb.to_image())
+
+
+def iter_frames(fp, every=1, keyframes=False):
+    kind = probe(fp)[0]
+    if kind == "video":
+        return iter_video_frames(fp, every, keyframes)
+    return iter_image_frames(fp, every)
+
+
+def signature(img):
+    # 场景切分用的 16x16 Lab 缩略图
+    small = img.resize((SIGNATURE_SIDE, SIGNATURE_SIDE), Image.BILINEAR)
+    return srgb_to_lab(np.asarray(small, dtype=np.float64))
+
+
+def extract_clip_palettes(frames, num_colors=5, space="rgb", scene_delta_e=SCENE_DELTA_E,
+                          max_scenes=MAX_SCENES, max_frames=MAX_SAMPLED_FRAMES):
+    # frames 为 Frame 的可迭代对象（可以是生成器）。返回 (整段的色板, [Scene])
+    # 码字随新场景增加（见 quantize.StreamingPalette），上限 4 * N_CODES，内存仍有界
+    stream = StreamingPalette(space=space, max_codes=4 * N_CODES)
+    scenes = []
+    prev = None
+    sampled = 0
+    with stage("clip_frames"):
+        for frame in frames:
+            checkpoint()
+            small = shrink(frame.image, FRAME_SIDE)
+            sig = signature(small)
+            cut = prev is None or (len(scenes) < max_scenes and delta_e(sig, prev).mean() > scene_delta_e)
+            if cut:
+                scenes.append([frame.index, frame.time_ms, 0, shrink(frame.image, THUMB_SIDE)])
+            prev = sig
+            scenes[-1][2] += 1
+            stream.partial_fit(np.asarray(small).reshape(-1, 3), key=len(scenes) - 1)
+            sampled += 1
+            if sampled >= max_frames:
+                break
+    if not scenes:
+        raise ValueError("没有可取色的帧")
+    note(frames=sampled, scenes=len(scenes))
+    with stage("clip_palettes"):
+        result = [Scene(start, start_ms, count, stream.palette(num_colors, i), thumb)
+                  for i, (start, start_ms, count, thumb) in enumerate(scenes)]
+        return stream.palette(num_colors), result
+
+
+def render_scene_strip(scenes, bg_color, num_colors=5, shape="方形", side=THUMB_SIDE, per_row=STRIP_PER_ROW):
+    # 每个场景一张与 make_palette_image 相同排版的色板卡（代表帧 + 色块），每行 per_row 张拼成一张图；
+    # 相邻卡片共用边框
+    with stage("clip_strip"):
+        cards = []
+        for scene in scenes:
+            thumb = center_crop_to_square(scene.thumbnail)
+            if thumb.size[0] != side:
+                thumb = thumb.resize((side, side), Image.LANCZOS, reducing_gap=2.0)
+            cards.append(render_palette_card(thumb, scene.palette, bg_color, num_colors=num_colors, shape=shape))
+        layout = card_layout(side, num_colors)
+        step_x, step_y = layout.width - layout.border, layout.height - layout.border
+        cols = min(per_row, len(cards))
+        rows = -(-len(cards) // cols)
+        strip = Image.new("RGB", (cols * step_x + layout.border, rows * step_y + layout.border), bg_color)
+        for i, card in enumerate(cards):
+            strip.paste(card, ((i % cols) * step_x, (i // cols) * step_y))
+        return strip
@@ -0,0 +1,174 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from PIL import Image
+
+from timing import note
+
+# 上传图片的资源限制：像素数、同时进行的解码/取色任务数、任务占用内存的预算、单个任务的耗时上限。
+# 超限的任务抛出 LimitExceeded 的子类，附带给用户看的说明和 HTTP 状态码，调用方照常捕获即可，
+# 不会拖垮整个进程。环境变量：
+#   PALETTE_MAX_PIXELS      单张图片的像素上限（默认 5000 万）
+#   PALETTE_MAX_JOBS        进程内同时执行的任务数（默认 CPU 核数）
+#   PALETTE_MEMORY_MB       进程内所有任务的内存预算（默认 2048）
+#   PALETTE_QUEUE_TIMEOUT   排队等待的最长秒数（默认 20）
+#   PALETTE_JOB_TIMEOUT     单个任务的最长秒数（默认 60，0 表示不限）
+# 超时是协作式的：各阶段之间调用 checkpoint() 检查，超过期限就中止，已经开始的单个阶段会先跑完。
+# 后台任务（见 progressive.py）被取消时也在 checkpoint() 处抛出 Cancelled。
+
+MAX_PIXELS = int(float(os.environ.get("PALETTE_MAX_PIXELS", 50e6)))
+MAX_JOBS = int(os.environ.get("PALETTE_MAX_JOBS", os.cpu_count() or 2))
+MEMORY_BUDGET = int(float(os.environ.get("PALETTE_MEMORY_MB", 2048)) * 2 ** 20)
+QUEUE_TIMEOUT = float(os.environ.get("PALETTE_QUEUE_TIMEOUT", 20))
+JOB_TIMEOUT = float(os.environ.get("PALETTE_JOB_TIMEOUT", 60)) or None
+
+# Pillow 自带的解压炸弹保护（超过 2 倍时直接报错）与本模块的像素上限保持一致
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+_deadline = contextvars.ContextVar("palette_deadline", default=None)
+_cancel = contextvars.ContextVar("palette_cancel", default=None)
+
+
+class LimitExceeded(Exception):
+    status_code = 413
+
+
+class ImageTooLarge(LimitExceeded):
+    status_code = 413
+
+
+class Busy(LimitExceeded):
+    status_code = 503
+
+
+class JobTimeout(LimitExceeded):
+    status_code = 504
+
+
+class Cancelled(Exception):
+    # 结果已不再需要（参数变了、换了图片），不是错误，调用方直接丢弃
+    pass
+
+
+def check_pixels(size):
+    w, h = size
+    if w * h > MAX_PIXELS:
+        raise ImageTooLarge(
+            f"图片分辨率过大（{w}×{h}，约 {w * h / 1e6:.1f} 百万像素），上限为 {MAX_PIXELS / 1e6:g} 百万像素"
+        )
+
+
+def estimate_bytes(size, source_format=None, full=True):
+    # 任务峰值内存的粗略估计：解码后的 RGB 图加上裁剪、色板图等工作副本。
+    # 只用小图时，JPEG 在解码阶段就按 1/2～1/8 缩小；其他格式仍要先完整解码
+    w, h = size
+    decoded = w * h * 3
+    if not full and source_format == "JPEG":
+        from decode import PROXY_SIDE
+        scale = min(max(min(w, h) // PROXY_SIDE, 1), 8)
+        decoded //= scale * scale
+    return decoded * (3 if full else 2)
+
+
+class ResourceGate:
+    # 进程内共享：同时执行的任务数 + 内存预算，超出时排队，排队超时则拒绝
+    def __init__(self, max_jobs=MAX_JOBS, memory_budget=MEMORY_BUDGET):
+        self.max_jobs = max_jobs
+        self.memory_budget = memory_budget
+        self.active = 0
+        self.reserved = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes, timeout=QUEUE_TIMEOUT):
+        if nbytes > self.memory_budget:
+            raise ImageTooLarge(
+                f"处理这张图片约需 {nbytes / 2 ** 20:.0f} MB 内存，超过上限 {self.memory_budget / 2 ** 20:.0f} MB，"
+                "请缩小图片后重试"
+            )
+        with self._cond:
+            ok = self._cond.wait_for(
+                lambda: self.active < self.max_jobs and self.reserved + nbytes <= self.memory_budget,
+                timeout=timeout,
+            )
+            if not ok:
+                raise Busy("服务繁忙，请稍后重试")
+            self.active += 1
+            self.reserved += nbytes
+
+    def release(self, nbytes):
+        with self._cond:
+            self.active -= 1
+            self.reserved -= nbytes
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "active": self.active,
+                "max_jobs": self.max_jobs,
+                "reserved_mb": round(self.reserved / 2 ** 20, 1),
+                "memory_budget_mb": round(self.memory_budget / 2 ** 20, 1),
+            }
+
+
+gate = ResourceGate()
+
+
+def checkpoint():
+    # 当前任务被取消时抛出 Cancelled，超过期限时抛出 JobTimeout；不在任务中时什么也不做
+    cancel = _cancel.get()
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+    deadline = _deadline.get()
+    if deadline is not None and time.monotonic() > deadline:
+        raise JobTimeout("处理超时，请换一张较小的图片或稍后重试")
+
+
+@contextmanager
+def job(nbytes, timeout=JOB_TIMEOUT):
+    # 占用一个任务名额和 nbytes 的内存预算，并设置任务期限；嵌套时只有最外层生效
+    if _deadline.get() is not None:
+        yield
+        return
+    start = time.perf_counter()
+    gate.acquire(nbytes)
+    note(queue_ms=round((time.perf_counter() - start) * 1000, 2), reserved_mb=round(nbytes / 2 ** 20, 1))
+    token = _deadline.set(time.monotonic() + timeout if timeout else float("inf"))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+        gate.release(nbytes)
+
+
+@contextmanager
+def cancellable(event):
+    # event（threading.Event）被设置后，其中的 checkpoint() 抛出 Cancelled
+    token = _cancel.set(event)
+    try:
+        yield
+    finally:
+        _cancel.reset(token)
+
+
+def peek_size(fp):
+    # 只读文件头、不解码像素，取得 (尺寸, 格式)，并检查像素上限
+    fp.seek(0)
+    try:
+        with Image.open(fp) as head:
+            size, fmt = head.size, head.format
+    except Image.DecompressionBombError:
+        raise ImageTooLarge(f"图片分辨率过大，上限为 {MAX_PIXELS / 1e6:g} 百万像素")
+    check_pixels(size)
+    return size, fmt
+
+
+@contextmanager
+def guarded(fp, full=True, timeout=JOB_TIMEOUT):
+    # 读文件头检查像素数，按估计的内存占用排队进入任务
+    size, fmt = peek_size(fp)
+    with job(estimate_bytes(size, fmt, full), timeout):
+        yield
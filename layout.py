@@ -0,0 +1,113 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# 色板图与壁纸的排版（纯整数运算，与像素无关）。
+# 排版只取决于 (尺寸, 颜色数, 比例)，按这些参数记忆化：批量处理同尺寸的图片、
+# 页面 rerun、fit_side 逐像素试探边长时都不再重复计算。
+
+MIN_COLORS = 3
+MAX_COLORS = 24
+MAX_PER_ROW = 6
+
+WALLPAPER_RATIOS = {"桌面": (16, 9), "手机": (9, 19.5)}
+# 常见设备的屏幕分辨率（宽, 高），壁纸可按这些尺寸精确输出
+DEVICE_RESOLUTIONS = {
+    "1080p 显示器": (1920, 1080),
+    "2K 显示器": (2560, 1440),
+    "4K 显示器": (3840, 2160),
+    "MacBook Air 13": (2560, 1664),
+    "iPhone 15": (1179, 2556),
+    "iPhone 15 Pro Max": (1290, 2796),
+    "安卓 FHD+": (1080, 2400),
+    "iPad Air": (1640, 2360),
+}
+
+CardLayout = namedtuple("CardLayout", "border cell_gap cell_size width height n_per_row n_rows")
+WallpaperLayout = namedtuple("WallpaperLayout", "width height x y card_width card_height")
+
+
+def palette_grid(num_colors):
+    # (每行色块数, 行数)：每行最多 MAX_PER_ROW 个，行数尽量少、各行尽量均匀（5 → 5x1，8 → 4x2，10 → 5x2）
+    if not MIN_COLORS <= num_colors <= MAX_COLORS:
+        raise ValueError(f"只支持{MIN_COLORS}～{MAX_COLORS}色")
+    n_rows = -(-num_colors // MAX_PER_ROW)
+    return -(-num_colors // n_rows), n_rows
+
+
+@lru_cache(maxsize=4096)
+def card_layout(w, num_colors):
+    # 边长为 w 的方图拼上色块后的排版
+    n_per_row, n_rows = palette_grid(num_colors)
+    border = max(24, w // 25)
+    cell_gap = max(14, w // 30)
+    cell_size = max((w - (n_per_row - 1) * cell_gap) // n_per_row, 1)
+    palette_h = n_rows * cell_size + (n_rows - 1) * cell_gap
+    return CardLayout(border, cell_gap, cell_size, w + 2 * border, w + cell_gap + palette_h + 2 * border,
+                      n_per_row, n_rows)
+
+
+@lru_cache(maxsize=1024)
+def fit_side(w, num_colors, max_edge=None):
+    # 满足“色板图最长边不超过 max_edge”的最大方图边长（不放大）
+    if max_edge is None:
+        return w
+
+    def longest(side):
+        layout = card_layout(side, num_colors)
+        return max(layout.width, layout.height)
+
+    side = min(w, int(w * max_edge / longest(w)))
+    while side > 1 and longest(side) > max_edge:
+        side -= 1
+    return max(side, 1)
+
+
+@lru_cache(maxsize=1024)
+def wallpaper_layout(size, ratio=(16, 9), device=None):
+    # 与 add_border + pad_to_ratio 串联的结果一致；device=(宽, 高) 时按设备宽高比排版，
+    # 再整体缩放到设备的精确分辨率（色板图随之缩放）
+    if device is not None:
+        ratio = device
+    palette_w, palette_h = size
+    # 根据壁纸比例自动放大/补边，边框宽度和分辨率自动（按色板图大小扩展、绝不压缩）
+    if ratio[0] / ratio[1] > palette_w / palette_h:
+        # 需要补上下
+        wall_w = palette_w
+        wall_h = int(palette_w * ratio[1] / ratio[0])
+    else:
+        # 需要补左右
+        wall_h = palette_h
+        wall_w = int(palette_h * ratio[0] / ratio[1])
+    border_width = min(wall_w, wall_h) // 4
+    w, h = palette_w + 2 * border_width, palette_h + 2 * border_width
+    target_w = w
+    target_h = int(w * ratio[1] / ratio[0])
+    if target_h < h:
+        target_h = h
+        target_w = int(h * ratio[0] / ratio[1])
+    x = (target_w - w) // 2 + border_width
+    y = (target_h - h) // 2 + border_width
+    if device is None:
+        return WallpaperLayout(target_w, target_h, x, y, palette_w, palette_h)
+    scale = min(device[0] / target_w, device[1] / target_h)
+    card_w = max(round(palette_w * scale), 1)
+    card_h = max(round(palette_h * scale), 1)
+    # 缩放后仍居中，保证色板图完整落在画布内
+    x = min(round((x + palette_w / 2) * scale - card_w / 2), device[0] - card_w)
+    y = min(round((y + palette_h / 2) * scale - card_h / 2), device[1] - card_h)
+    return WallpaperLayout(device[0], device[1], max(x, 0), max(y, 0), card_w, card_h)
+
+
+def parse_resolution(text):
+    # "2560x1440"、"2560×1440"、"2560*1440" 或 DEVICE_RESOLUTIONS 里的设备名 -> (宽, 高)；无法识别时返回 None
+    if text in DEVICE_RESOLUTIONS:
+        return DEVICE_RESOLUTIONS[text]
+    m = re.fullmatch(r"\s*(\d+)\s*[xX×*]\s*(\d+)\s*", text)
+    if m is None or not all(int(v) > 0 for v in m.groups()):
+        return None
+    return int(m.group(1)), int(m.group(2))
+
+
+def orientation(size):
+    return "landscape" if size[0] >= size[1] else "portrait"
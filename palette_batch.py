@@ -0,0 +1,357 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+
+import guardrails
+import timing
+from colorspace import SPACES
+from decode import DecodedUpload, load_reduced
+from encoders import OUTPUT_FORMATS, encode_image
+from layout import MAX_COLORS, MIN_COLORS, WALLPAPER_RATIOS, orientation, parse_resolution
+from palette_image import center_crop_to_square, hex_to_rgb, make_palette_image, make_wallpaper, palette_hierarchy
+from palette_index import PaletteIndex
+from quantize import QUANTIZERS, extract_colors_streaming
+from swatches import SHAPES
+
+# 批量生成色板（无界面）：
+#   python palette_batch.py 图片目录或通配符 ... -o 输出目录 --workers 8 --wallpaper 桌面,手机
+# 输出色板图、壁纸以及 manifest.json / manifest.csv（各图的十六进制颜色）。
+# 输出文件比原图新、且上次的 manifest 里已有记录的图片会被跳过，可中断后续跑。
+# --album 额外对全部图片做一次流式取色，输出 album.json（合并色板 + 各图色板）。超过 ALBUM_PIXELS 的图片
+# 按整数倍缩小到其 1～4 倍后再取色（JPEG 用 draft 在解码时缩小，其他格式仍要先完整解码），峰值内存取决于最大的一张图的解码，
+# 并计入 guardrails 的内存预算；参数和图片都没有变化时沿用上次的 album.json。
+# --index 把各图的色板及像素占比写入色板索引，供 palette_index.py 按色板、按颜色查找图片。
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg")
+BG_COLORS = {"白色": "#F5F5F5", "黑色": "#1C1C1C"}
+ALBUM_PIXELS = 4_000_000
+
+
+def collect_inputs(patterns):
+    # 返回 [(原图路径, 相对名)]，相对名用于在输出目录中保留子目录结构
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTS):
+                        path = os.path.join(root, name)
+                        found.append((path, os.path.relpath(path, pattern)))
+        else:
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTS):
+                    found.append((path, os.path.basename(path)))
+    seen = set()
+    unique = []
+    for path, rel in found:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append((path, rel))
+    return unique
+
+
+def wallpaper_target(name):
+    # 壁纸用途（桌面/手机）-> (比例, None)；分辨率或设备名 -> (分辨率, 分辨率)；无法识别时返回 None
+    if name in WALLPAPER_RATIOS:
+        return WALLPAPER_RATIOS[name], None
+    device = parse_resolution(name)
+    return (device, device) if device else None
+
+
+def planned_outputs(rel, out_dir, wallpapers, fmt="png"):
+    stem = os.path.splitext(rel)[0]
+    base = os.path.join(out_dir, stem)
+    ext = OUTPUT_FORMATS[fmt]["ext"]
+    outputs = {"palette": f"{base}_palette.{ext}"}
+    for name in wallpapers:
+        ratio, device = wallpaper_target(name)
+        suffix = "%dx%d" % device if device else orientation(ratio)
+        outputs[name] = f"{base}_palette_{suffix}.{ext}"
+    return outputs
+
+
+def is_up_to_date(src, outputs):
+    src_mtime = os.path.getmtime(src)
+    for path in outputs.values():
+        if not os.path.exists(path) or os.path.getmtime(path) < src_mtime:
+            return False
+    return True
+
+
+def write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def hex_colors(colors):
+    return ['#%02x%02x%02x' % tuple(c) for c in colors]
+
+
+def _limit_worker_threads():
+    # 多进程时让每个进程的 BLAS/OpenMP 只用一个线程，避免线程数 = 进程数 × 核数
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(1)
+
+
+def process_one(job):
+    src, rel, outputs, opts = job
+    start = time.perf_counter()
+    run_trace = timing.begin("batch_image", source=src)
+    try:
+        origin_name = os.path.splitext(os.path.basename(rel))[0]
+        # 超大图片、超出内存预算或超时（见 guardrails.py）与坏图一样记为 error，不影响其他图片
+        with open(src, "rb") as fp, guardrails.guarded(fp):
+            upload = DecodedUpload(fp)
+            card_bytes, _, palette, palette_img = make_palette_image(
+                upload.full(), opts["bg_color"], origin_name, num_colors=opts["num_colors"],
+                wide_palette=opts["wide_palette"], shape=opts["shape"], method=opts["method"],
+                palette_source=upload.proxy, max_edge=opts["max_edge"], fmt=opts["format"],
+                space=opts["space"], merge_delta_e=opts["merge_delta_e"],
+            )
+            # 各颜色的像素占比（聚类结果已在缓存中），供色板索引加权
+            weights = [round(w, 4) for _, w in palette_hierarchy(
+                center_crop_to_square(upload.proxy), opts["method"], opts["space"], opts["merge_delta_e"],
+            ).pick_weighted(opts["num_colors"], opts["wide_palette"])]
+        os.makedirs(os.path.dirname(outputs["palette"]) or ".", exist_ok=True)
+        write_bytes(outputs["palette"], card_bytes)
+        fill = palette[min(opts["fill_index"], len(palette) - 1)]
+        for name in opts["wallpapers"]:
+            ratio, device = wallpaper_target(name)
+            wallpaper_img = make_wallpaper(palette_img, ratio=ratio, color=fill, device=device)
+            with timing.stage("wallpaper_encode"):
+                data = encode_image(wallpaper_img, opts["format"])[0]
+            write_bytes(outputs[name], data)
+        return {
+            "source": src,
+            "status": "ok",
+            "settings": opts["signature"],
+            "colors": hex_colors(palette),
+            "weights": weights,
+            "outputs": outputs,
+            "seconds": round(time.perf_counter() - start, 3),
+            "stages_ms": run_trace.finish()["stages_ms"],
+        }
+    except Exception as e:
+        run_trace.finish()
+        return {"source": src, "status": "error", "error": f"{type(e).__name__}: {e}", "outputs": outputs}
+
+
+def album_min_side(size, max_pixels=ALBUM_PIXELS):
+    # load_reduced 的 min_side：像素数超过 max_pixels 两倍边长以上时整数倍缩小到其附近，否则原尺寸
+    w, h = size
+    scale = (w * h / max_pixels) ** 0.5
+    return max(1, int(min(w, h) / scale)) if scale >= 2 else None
+
+
+def album_bytes(size, fmt, max_pixels=ALBUM_PIXELS):
+    # 峰值内存估计：解码出的 RGB 图（JPEG 的 draft 最多比请求的尺寸大一倍边长）+ 缩小后的副本
+    pixels = size[0] * size[1]
+    reduced = min(pixels, 4 * max_pixels)
+    return ((reduced if fmt == "JPEG" else pixels) + reduced) * 3
+
+
+def iter_album_images(sources):
+    # 逐张解码，同一时刻只占一张图的内存；图片交给取色期间一直占着 guardrails 的内存预算。坏图、超限的图跳过
+    for src in sources:
+        with ExitStack() as stack:
+            try:
+                fp = stack.enter_context(open(src, "rb"))
+                size, fmt = guardrails.peek_size(fp)
+                stack.enter_context(guardrails.job(album_bytes(size, fmt), timeout=None))
+                image = load_reduced(fp, album_min_side(size))
+            except Exception as e:
+                print(f"相册取色跳过 {src}：{type(e).__name__}: {e}", file=sys.stderr)
+                continue
+            yield src, image
+            # 解码下一张之前放掉这一张
+            del image
+
+
+def album_settings(opts):
+    return json.dumps({"num_colors": opts["num_colors"], "space": opts["space"], "max_pixels": ALBUM_PIXELS},
+                      sort_keys=True)
+
+
+def load_album(out_dir, sources, opts):
+    # 上次的 album.json 仍然有效（参数、图片列表相同且没有图片比它新）时返回它，否则返回 None
+    path = os.path.join(out_dir, "album.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            album = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if album.get("settings") != album_settings(opts) or album.get("sources") != sorted(sources):
+        return None
+    if not all(is_up_to_date(src, {"album": path}) for src in sources):
+        return None
+    return album
+
+
+def write_album(out_dir, sources, opts):
+    with timing.trace("batch_album", images=len(sources)):
+        combined, per_image = extract_colors_streaming(
+            iter_album_images(sources), opts["num_colors"], space=opts["space"])
+    album = {
+        "colors": hex_colors(combined),
+        "images": {src: hex_colors(colors) for src, colors in sorted(per_image.items())},
+        "settings": album_settings(opts),
+        "sources": sorted(sources),
+    }
+    path = os.path.join(out_dir, "album.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(album, f, ensure_ascii=False, indent=2)
+    return path, album
+
+
+def load_manifest(out_dir):
+    path = os.path.join(out_dir, "manifest.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {entry["source"]: entry for entry in json.load(f)}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def write_manifest(out_dir, entries):
+    json_path = os.path.join(out_dir, "manifest.json")
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, json_path)
+
+    with open(os.path.join(out_dir, "manifest.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "status", "colors", "palette", "error"])
+        for entry in entries:
+            writer.writerow([
+                entry["source"], entry["status"], " ".join(entry.get("colors", [])),
+                entry.get("outputs", {}).get("palette", ""), entry.get("error", ""),
+            ])
+
+
+def update_index(path, entries, processed):
+    # 本次处理过的图片覆盖旧记录；跳过的图片只在索引里还没有时补上
+    index = PaletteIndex(path)
+    added = 0
+    for entry in entries:
+        src = entry["source"]
+        if entry["status"] != "ok" or (src in index and src not in processed):
+            continue
+        colors = [hex_to_rgb(c) for c in entry["colors"]]
+        index.add(src, colors, entry.get("weights"))
+        added += 1
+    index.flush()
+    return index, added
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="批量生成图片色板与壁纸")
+    parser.add_argument("inputs", nargs="+", help="图片、目录或通配符（如 'photos/**/*.jpg'）")
+    parser.add_argument("-o", "--out-dir", required=True, help="输出目录")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="进程数")
+    parser.add_argument("--colors", type=int, choices=range(MIN_COLORS, MAX_COLORS + 1), default=5,
+                        metavar=f"{MIN_COLORS}-{MAX_COLORS}", help="取色数量")
+    parser.add_argument("--wide", action="store_true", help="宽取色范围（仅 5 色）")
+    parser.add_argument("--shape", choices=SHAPES, default="方形", help="色块形状")
+    parser.add_argument("--bg", default="白色", help="边框色：白色/黑色 或 #RRGGBB")
+    parser.add_argument("--method", choices=list(QUANTIZERS), default="kmeans", help="取色算法")
+    parser.add_argument("--max-edge", type=int, default=None, help="色板图最长边（像素），默认按原图分辨率")
+    parser.add_argument("--format", choices=list(OUTPUT_FORMATS), default="png", help="输出格式")
+    parser.add_argument("--space", choices=list(SPACES), default="rgb", help="聚类所用的色彩空间")
+    parser.add_argument("--merge-delta-e", type=float, default=None, help="合并色差 ΔE 小于该值的近似重复色")
+    parser.add_argument("--wallpaper", default="",
+                        help="逗号分隔的壁纸用途：桌面,手机，或按分辨率精确输出：2560x1440,iPhone 15")
+    parser.add_argument("--fill", type=int, default=1, help="壁纸填充色在色板中的序号（从 1 开始）")
+    parser.add_argument("--force", action="store_true", help="忽略已有输出，全部重新生成")
+    parser.add_argument("--album", action="store_true", help="额外输出全部图片的合并色板 album.json")
+    parser.add_argument("--index", default=None, help="把色板写入该目录下的色板索引（见 palette_index.py）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    wallpapers = [w for w in args.wallpaper.split(",") if w]
+    for name in wallpapers:
+        if wallpaper_target(name) is None:
+            sys.exit(f"未知的壁纸用途：{name}（可选：{'、'.join(WALLPAPER_RATIOS)}、宽x高 或设备名）")
+    try:
+        bg_color = hex_to_rgb(BG_COLORS.get(args.bg, args.bg))
+    except ValueError:
+        sys.exit(f"无效的边框色：{args.bg}（可选：{'、'.join(BG_COLORS)} 或 #RRGGBB）")
+    opts = {
+        "bg_color": bg_color,
+        "num_colors": args.colors,
+        "wide_palette": args.wide and args.colors == 5,
+        "shape": args.shape,
+        "method": args.method,
+        "wallpapers": wallpapers,
+        "fill_index": max(args.fill, 1) - 1,
+        "max_edge": args.max_edge,
+        "format": args.format,
+        "space": args.space,
+        "merge_delta_e": args.merge_delta_e,
+    }
+    # 参数变化后旧输出不再算“最新”
+    opts["signature"] = json.dumps(opts, sort_keys=True, ensure_ascii=False)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    previous = {} if args.force else load_manifest(args.out_dir)
+    entries = {}
+    jobs = []
+    inputs = collect_inputs(args.inputs)
+    for src, rel in inputs:
+        outputs = planned_outputs(rel, args.out_dir, wallpapers, args.format)
+        old = previous.get(src)
+        if (old and old.get("status") == "ok" and old.get("settings") == opts["signature"]
+                and old.get("outputs") == outputs and is_up_to_date(src, outputs)):
+            entries[src] = old
+            continue
+        jobs.append((src, rel, outputs, opts))
+
+    skipped = len(entries)
+    print(f"共 {len(jobs) + skipped} 张图片，跳过已是最新的 {skipped} 张，待处理 {len(jobs)} 张")
+    failed = 0
+    start = time.perf_counter()
+    if jobs:
+        with ProcessPoolExecutor(max_workers=max(args.workers, 1), initializer=_limit_worker_threads) as pool:
+            futures = [pool.submit(process_one, job) for job in jobs]
+            for done, future in enumerate(as_completed(futures), start=1):
+                entry = future.result()
+                entries[entry["source"]] = entry
+                if entry["status"] != "ok":
+                    failed += 1
+                    print(f"[{done}/{len(jobs)}] 失败 {entry['source']}：{entry['error']}", file=sys.stderr)
+                else:
+                    print(f"[{done}/{len(jobs)}] {entry['source']} {' '.join(entry['colors'])}")
+    elapsed = time.perf_counter() - start
+
+    ordered = [entries[src] for src in sorted(entries)]
+    write_manifest(args.out_dir, ordered)
+    rate = len(jobs) / elapsed if elapsed > 0 else 0.0
+    print(f"完成 {len(jobs) - failed} 张，失败 {failed} 张，用时 {elapsed:.1f}s（{rate:.2f} 张/秒）")
+    if args.index:
+        index, added = update_index(args.index, ordered, {job[0] for job in jobs})
+        print(f"色板索引写入 {added} 条，共 {len(index)} 张图片 → {args.index}")
+    if args.album and inputs:
+        sources = [src for src, _ in inputs]
+        album = None if args.force else load_album(args.out_dir, sources, opts)
+        if album is not None:
+            print(f"相册色板已是最新 {' '.join(album['colors'])}")
+        else:
+            path, album = write_album(args.out_dir, sources, opts)
+            print(f"相册色板 {' '.join(album['colors'])} → {path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
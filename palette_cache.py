@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from result_store import get_store, store_key
+
+# 色板缓存：键为（解码后像素的哈希, 取色参数…），值为可 JSON 序列化的取色结果
+# 一级为内存 LRU，二级为可选的磁盘目录（环境变量 PALETTE_CACHE_DIR 启用），
+# 三级为跨进程共享的结果库（环境变量 PALETTE_STORE 启用，见 result_store.py）
+
+
+def image_digest(img):
+    arr = np.ascontiguousarray(np.asarray(img.convert("RGB")))
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(arr.shape).encode())
+    h.update(arr.data)
+    return h.hexdigest()
+
+
+class PaletteCache:
+    def __init__(self, max_items=256, disk_dir=None, store=None):
+        self.max_items = max_items
+        self.disk_dir = disk_dir
+        self.store = store
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        name = "_".join(str(k) for k in key)
+        return os.path.join(self.disk_dir, name + ".json")
+
+    def _remember(self, key, value):
+        # 调用方需持有锁
+        self._mem[key] = value
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return self._mem[key]
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), "r") as f:
+                    value = json.load(f)
+            except (OSError, ValueError):
+                value = None
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, value)
+                return value
+        if self.store is not None:
+            value = self.store.get_json(store_key("palette", *key))
+            if value is not None:
+                with self._lock:
+                    self.store_hits += 1
+                    self._remember(key, value)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+        if self.disk_dir:
+            # 先写临时文件再原子替换，避免并发读到半个文件
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(value, f)
+                os.replace(tmp_path, path)
+            except OSError:
+                pass
+        if self.store is not None:
+            self.store.put_json(store_key("palette", *key), value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            found = self.hits + self.disk_hits + self.store_hits
+            lookups = found + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "size": len(self._mem),
+                "hit_rate": found / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            self.hits = self.disk_hits = self.store_hits = self.misses = 0
+
+
+# 进程内共享一个实例：Streamlit 每次 rerun 会重新执行 app.py，但不会重新导入本模块
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_cache():
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = PaletteCache(
+                max_items=int(os.environ.get("PALETTE_CACHE_SIZE", "256")),
+                disk_dir=os.environ.get("PALETTE_CACHE_DIR") or None,
+                store=get_store(),
+            )
+        return _default_cache
@@ -0,0 +1,129 @@
+import numpy as np
+
+from colorspace import from_space
+from quantize import extract_centroids, merge_close_centers, order_by_population
+
+# 色板层级：对图片只做一次“过量聚类”（默认 32 个中心），再用 Ward 法把这些中心
+# 两两合并成一棵树。任意取色数量的色板都是在这棵树上“剪一刀”，无需重新聚类。
+# 中心和合并都在聚类所用的色彩空间（space）里进行，只在输出颜色时换算回 sRGB。
+
+N_LEAVES = 32
+WIDE_INDICES = [0, 2, 4, 7, 9]
+
+
+class PaletteHierarchy:
+    def __init__(self, centers, weights, merges=None, space="rgb"):
+        self.space = space
+        self.centers = np.asarray(centers, dtype=np.float64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        if merges is None:
+            self._build()
+        else:
+            self.merges = np.asarray(merges, dtype=np.int64).reshape(-1, 2)
+            self._replay()
+        self._index()
+        self._palettes = {}
+
+    @classmethod
+    def from_image(cls, image, n_leaves=N_LEAVES, method="kmeans", space="rgb", merge_delta_e=None):
+        centers, weights = extract_centroids(image, n_leaves, method=method, space=space)
+        filled = weights > 0
+        centers, weights = centers[filled], weights[filled]
+        if merge_delta_e:
+            # 先合并感知上几乎相同的叶子，避免大面积同色区域占掉多个色块
+            centers, weights = merge_close_centers(centers, weights, merge_delta_e, space)
+        return cls(centers, weights, space=space)
+
+    @property
+    def n_leaves(self):
+        return len(self.merges) + 1
+
+    def _build(self):
+        # 朴素 Ward 合并：叶子数很少（几十个），O(n^3) 也只需约 1ms
+        n = len(self.centers)
+        centers = list(self.centers)
+        weights = list(self.weights)
+        alive = list(range(n))
+        merges = []
+        while len(alive) > 1:
+            c = np.array([centers[i] for i in alive])
+            w = np.array([weights[i] for i in alive])
+            d = ((c[:, None, :] - c[None, :, :]) ** 2).sum(-1)
+            cost = d * (w[:, None] * w[None, :]) / np.maximum(w[:, None] + w[None, :], 1e-12)
+            cost[np.diag_indices(len(alive))] = np.inf
+            a, b = np.unravel_index(np.argmin(cost), cost.shape)
+            i, j = alive[a], alive[b]
+            total = weights[i] + weights[j]
+            if total > 0:
+                merged = (centers[i] * weights[i] + centers[j] * weights[j]) / total
+            else:
+                merged = (centers[i] + centers[j]) / 2
+            centers.append(merged)
+            weights.append(total)
+            merges.append((i, j))
+            alive = [x for x in alive if x not in (i, j)] + [len(centers) - 1]
+        self.centers = np.array(centers).reshape(-1, 3)
+        self.weights = np.array(weights)
+        self.merges = np.array(merges, dtype=np.int64).reshape(-1, 2)
+
+    def _index(self):
+        # born[x]：节点 x 在第几次合并后出现；dead[x]：在第几次合并时被并掉
+        n = self.n_leaves
+        total = len(self.centers)
+        self.born = np.zeros(total, dtype=np.int64)
+        self.born[n:] = np.arange(1, total - n + 1)
+        self.dead = np.full(total, np.iinfo(np.int64).max)
+        for step, (i, j) in enumerate(self.merges, start=1):
+            self.dead[i] = step
+            self.dead[j] = step
+
+    def _replay(self):
+        # 只给出叶子和合并顺序时，补算内部节点的中心和权重
+        centers = list(self.centers)
+        weights = list(self.weights)
+        for i, j in self.merges:
+            total = weights[i] + weights[j]
+            if total > 0:
+                merged = (centers[i] * weights[i] + centers[j] * weights[j]) / total
+            else:
+                merged = (centers[i] + centers[j]) / 2
+            centers.append(merged)
+            weights.append(total)
+        self.centers = np.array(centers).reshape(-1, 3)
+        self.weights = np.array(weights)
+
+    def _cut(self, num_colors):
+        # 树上剪一刀：返回按像素数排序的 (颜色列表, 占比列表)
+        if num_colors not in self._palettes:
+            steps = max(self.n_leaves - num_colors, 0)
+            alive = (self.born <= steps) & (self.dead > steps)
+            centers, weights = self.centers[alive], self.weights[alive]
+            colors = order_by_population(from_space(centers, self.space), weights, num_colors)
+            shares = np.sort(weights)[::-1] / max(weights.sum(), 1e-12)
+            shares = list(shares[:num_colors]) + [0.0] * (num_colors - min(len(shares), num_colors))
+            self._palettes[num_colors] = (colors, [float(x) for x in shares])
+        return self._palettes[num_colors]
+
+    def pick(self, num_colors=5, wide_palette=False):
+        return [color for color, _ in self.pick_weighted(num_colors, wide_palette)]
+
+    def pick_weighted(self, num_colors=5, wide_palette=False):
+        # [(颜色, 像素占比)]，占比相对整张图
+        if num_colors == 5 and wide_palette:
+            colors, shares = self._cut(10)
+            return [(colors[i], shares[i]) for i in WIDE_INDICES]
+        colors, shares = self._cut(num_colors)
+        return list(zip(colors, shares))
+
+    def to_dict(self):
+        n = self.n_leaves
+        return {
+            "centers": self.centers[:n].round(3).tolist(),
+            "weights": self.weights[:n].tolist(),
+            "merges": self.merges.tolist(),
+            "space": self.space,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["centers"], data["weights"], data["merges"], space=data.get("space", "rgb"))
@@ -0,0 +1,125 @@
+from PIL import Image, ImageOps
+from encoders import encode_image, with_extension
+from guardrails import checkpoint
+from palette_cache import get_cache, image_digest
+from palette_hierarchy import PaletteHierarchy
+from quantize import extract_colors
+from layout import card_layout, fit_side, orientation, wallpaper_layout
+from swatches import render_swatches
+from timing import note, stage
+
+# 色板图、壁纸的生成函数（Streamlit 页面与批处理命令行共用）
+
+QUICK_SAMPLE = 4096
+
+def encode_png(img):
+    # 只在内存中编码一次，预览和下载共用同一份字节，不落盘
+    return encode_image(img, "png")[0]
+
+def hex_to_rgb(hexstr):
+    hexstr = hexstr.strip().lstrip('#')
+    return tuple(int(hexstr[i:i+2], 16) for i in (0, 2, 4))
+
+def center_crop_to_square(img):
+    w, h = img.size
+    if w == h:
+        return img
+    short_side = min(w, h)
+    left = (w - short_side) // 2
+    top = (h - short_side) // 2
+    right = left + short_side
+    bottom = top + short_side
+    return img.crop((left, top, right, bottom))
+
+def add_border(img, border=40, color=(245,245,245)):
+    return ImageOps.expand(img, border=border, fill=color)
+
+def pad_to_ratio(img, ratio=(16,9), color=(245,245,245)):
+    w, h = img.size
+    target_w = w
+    target_h = int(w * ratio[1] / ratio[0])
+    if target_h < h:
+        target_h = h
+        target_w = int(h * ratio[0] / ratio[1])
+    pad_left = (target_w - w) // 2
+    pad_top = (target_h - h) // 2
+    padded_img = ImageOps.expand(img, border=(pad_left, pad_top, target_w - w - pad_left, target_h - h - pad_top), fill=color)
+    return padded_img
+
+def palette_hierarchy(img, method="kmeans", space="rgb", merge_delta_e=None, cached_only=False):
+    # 每张图只聚类一次，5/8/10 色及宽窄色板都从同一棵层级树上取
+    # cached_only 时只查缓存，未命中返回 None（渐进模式据此决定是否先出粗略预览）
+    with stage("hash"):
+        key = (image_digest(img), method, space, merge_delta_e or 0)
+    cache = get_cache()
+    data = cache.get(key)
+    note(palette_cache="hit" if data is not None else "miss")
+    if data is None:
+        if cached_only:
+            return None
+        checkpoint()
+        with stage("cluster"):
+            tree = PaletteHierarchy.from_image(img, method=method, space=space, merge_delta_e=merge_delta_e)
+            data = cache.put(key, tree.to_dict())
+    return PaletteHierarchy.from_dict(data)
+
+def quick_palette(img, num_colors=5, space="rgb"):
+    # 粗略色板：几千个采样点上的直方图聚类，几毫秒内出结果，只用于细化完成前的预览
+    with stage("quick_palette"):
+        return extract_colors(img, num_colors, method="histogram", space=space, budget=QUICK_SAMPLE, early_stop=False)
+
+def render_palette_card(img, palette, bg_color, num_colors=5, shape="方形", max_edge=None):
+    img = center_crop_to_square(img)
+    side = fit_side(img.size[0], num_colors, max_edge)
+    if side < img.size[0]:
+        img = img.resize((side, side), Image.LANCZOS, reducing_gap=2.0)
+    w, h = img.size
+    # 3～24 色的网格、色块边长和间距见 layout.py
+    layout = card_layout(w, num_colors)
+    new_img = Image.new('RGB', (layout.width, layout.height), bg_color)
+    new_img.paste(img, (layout.border, layout.border))
+    # 整条色块一次算好（圆形等带抗锯齿，见 swatches.py），一次粘贴
+    strip = render_swatches(palette, layout.n_per_row, layout.n_rows, layout.cell_size, layout.cell_gap,
+                            bg_color, shape)
+    new_img.paste(strip, (layout.border, layout.border + h + layout.cell_gap))
+    return new_img
+
+def make_palette_image(img, bg_color, origin_name, num_colors=5, wide_palette=False, shape="方形", method="kmeans",
+                       palette_source=None, max_edge=None, fmt="png", space="rgb", merge_delta_e=None):
+    # 主色提取（按像素哈希缓存，切换形状/边框色/取色数量时不再重新聚类）
+    # palette_source 为同一张图的缩小版（见 decode.DecodedUpload.proxy）时，哈希和聚类都在小图上做
+    with stage("crop"):
+        source = center_crop_to_square(img if palette_source is None else palette_source)
+    # space/merge_delta_e：在感知均匀的色彩空间中聚类、合并近似重复色（见 quantize.py）
+    palette = palette_hierarchy(source, method, space, merge_delta_e).pick(num_colors, wide_palette)
+    # max_edge 限制输出色板图的最长边，None 表示按原图分辨率
+    # checkpoint：任务超过期限（见 guardrails.py）时在阶段之间中止
+    checkpoint()
+    with stage("render"):
+        new_img = render_palette_card(img, palette, bg_color, num_colors=num_colors, shape=shape, max_edge=max_edge)
+    # fmt 为 encoders.OUTPUT_FORMATS 的键，默认 PNG
+    palette_name = with_extension(origin_name + "_palette.png", fmt)
+    checkpoint()
+    with stage("encode"):
+        data = encode_image(new_img, fmt)[0]
+    note(card_size=list(new_img.size))
+    return data, palette_name, palette, new_img
+
+def make_wallpaper(palette_img, ratio=(16,9), color=(245,245,245), device=None):
+    # 一次分配画布、一次粘贴，代替两次 ImageOps.expand 的整图复制
+    # device=(宽, 高) 时输出恰好为该分辨率，色板图按比例缩放后居中
+    checkpoint()
+    with stage("wallpaper"):
+        layout = wallpaper_layout(palette_img.size, tuple(ratio), device and tuple(device))
+        card_size = (layout.card_width, layout.card_height)
+        if card_size != palette_img.size:
+            palette_img = palette_img.resize(card_size, Image.LANCZOS, reducing_gap=2.0)
+        wallpaper = Image.new('RGB', (layout.width, layout.height), color)
+        wallpaper.paste(palette_img, (layout.x, layout.y))
+    return wallpaper
+
+def wallpaper_file_name(origin_name, size, device=None):
+    # 判断横竖；按设备分辨率输出时文件名带上分辨率
+    if device is not None:
+        return f"{origin_name}_palette_{device[0]}x{device[1]}.png"
+    return f"{origin_name}_palette_{orientation(size)}.png"
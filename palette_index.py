@@ -0,0 +1,288 @@
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from colorspace import srgb_to_lab
+
+# 色板相似度索引：“找出色板相近的图片”“哪些图片含有这个颜色”“与这个壁纸填充色最接近的图片”。
+# 每张图片的色板存成固定长度的记录：n_colors 个 (L, a, b, 占比) 的 float32，不足的位置重复第一个颜色、占比为 0。
+# 目录下三个文件：
+#   palettes.f32   所有记录首尾相接的原始数组，查询时以 np.memmap 只读映射，不整体读进内存
+#   keys.txt       每行一个 JSON 字符串，第 i 行是第 i 条记录的键（通常是图片路径）
+#   meta.json      n_colors 等参数
+# 写入只追加；同一个键再次写入时以最后一条为准，旧记录在 compact() 时清掉。
+# 查询是按块的向量化距离计算：每块 SEARCH_CHUNK 条记录先转成按列存放的 (L/a/b/占比, 颜色位, 记录)，
+# 块足够小、能留在 CPU 缓存里，之后逐个查询颜色做整列运算，归约都沿第一维进行（NumPy 在小的末维上归约很慢）。
+#   色板距离 —— 带权双向最近色差：A 的每个颜色到 B 中最近颜色的 ΔE 按 A 的占比加权，反过来同样，取平均。
+#               是 EMD（推土机距离）的廉价近似，不解运输问题；单核 30 万条约 60 毫秒（benchmarks/bench_index.py）
+#   单色查询 —— 每张图片色板里与目标色 ΔE 最小的颜色，可要求该颜色的占比不低于 min_weight
+
+INDEX_COLORS = 8
+FIELDS = 4  # L, a, b, 占比
+SEARCH_CHUNK = 4096
+VERSION = 1
+
+IndexView = namedtuple("IndexView", "data keys rows live")
+
+
+class PaletteIndex:
+    def __init__(self, path, n_colors=INDEX_COLORS):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except OSError:
+            meta = {"version": VERSION, "n_colors": n_colors}
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        self.n_colors = meta["n_colors"]
+        self._pending = []
+        self._lock = threading.Lock()
+        self._size = None
+        self.refresh()
+
+    @property
+    def _data_path(self):
+        return os.path.join(self.path, "palettes.f32")
+
+    @property
+    def _keys_path(self):
+        return os.path.join(self.path, "keys.txt")
+
+    def refresh(self):
+        # 其他进程追加了记录时重新映射；文件大小没变时什么也不做
+        try:
+            size = os.path.getsize(self._data_path)
+        except OSError:
+            size = 0
+        if size == self._size:
+            return
+        try:
+            with open(self._keys_path, "r", encoding="utf-8") as f:
+                keys = [json.loads(line) for line in f if line.strip()]
+        except OSError:
+            keys = []
+        # 写入中途读到时两边可能差一条，以较短的为准
+        n = min(size // (self.n_colors * FIELDS * 4), len(keys))
+        if n:
+            data = np.memmap(self._data_path, dtype=np.float32, mode="r", shape=(n, self.n_colors, FIELDS))
+        else:
+            data = np.zeros((0, self.n_colors, FIELDS), dtype=np.float32)
+        rows = {key: i for i, key in enumerate(keys[:n])}
+        live = np.zeros(n, dtype=bool)
+        live[list(rows.values())] = True
+        # 整体替换，查询中途另一个线程 refresh 也不会读到不一致的组合
+        self._view = IndexView(data, keys[:n], rows, live)
+        self._size = size
+
+    def __len__(self):
+        return len(self._view.rows)
+
+    def __contains__(self, key):
+        return key in self._view.rows
+
+    def keys(self):
+        return list(self._view.rows)
+
+    def _prepare(self, colors, weights=None):
+        # 颜色多于 n_colors 时保留占比最大的几个；占比归一化
+        colors = np.asarray(colors, dtype=np.float64).reshape(-1, 3)
+        if not len(colors):
+            raise ValueError("色板不能为空")
+        weights = np.ones(len(colors)) if weights is None else np.asarray(weights, dtype=np.float64)
+        order = np.argsort(-weights, kind="stable")[:self.n_colors]
+        colors, weights = colors[order], weights[order]
+        total = weights.sum()
+        weights = weights / total if total > 0 else np.full(len(weights), 1 / len(weights))
+        return colors, weights
+
+    def _encode(self, palettes):
+        # [(颜色, 占比)] -> (条数, n_colors, 4) 记录；所有颜色一次转换到 Lab
+        lab = srgb_to_lab(np.concatenate([colors for colors, _ in palettes]))
+        records = np.zeros((len(palettes), self.n_colors, FIELDS), dtype=np.float32)
+        start = 0
+        for record, (colors, weights) in zip(records, palettes):
+            n = len(colors)
+            record[:, :3] = lab[start]
+            record[:n, :3] = lab[start:start + n]
+            record[:n, 3] = weights
+            start += n
+        return records
+
+    def encode(self, colors, weights=None):
+        # [(r, g, b)] + 占比 -> (n_colors, 4) 记录
+        return self._encode([self._prepare(colors, weights)])[0]
+
+    def add(self, key, colors, weights=None):
+        # 先缓存在内存里，flush() 时一次追加到文件
+        self._pending.append((key, self._prepare(colors, weights)))
+
+    def flush(self):
+        if not self._pending:
+            return
+        with self._lock:
+            records = self._encode([palette for _, palette in self._pending])
+            # 先写记录再写键：中途中断时多出的记录没有对应的键，读取时会被忽略
+            with open(self._data_path, "ab") as f:
+                f.write(records.tobytes())
+            with open(self._keys_path, "a", encoding="utf-8") as f:
+                for key, _ in self._pending:
+                    f.write(json.dumps(key, ensure_ascii=False) + "\n")
+            self._pending = []
+        self.refresh()
+
+    def compact(self):
+        # 去掉被覆盖的旧记录，写到临时文件后替换
+        self.flush()
+        with self._lock:
+            view = self._view
+            rows = np.flatnonzero(view.live)
+            tmp_data, tmp_keys = self._data_path + ".tmp", self._keys_path + ".tmp"
+            with open(tmp_data, "wb") as f:
+                for start in range(0, len(rows), SEARCH_CHUNK):
+                    f.write(np.ascontiguousarray(view.data[rows[start:start + SEARCH_CHUNK]]).tobytes())
+            with open(tmp_keys, "w", encoding="utf-8") as f:
+                for i in rows:
+                    f.write(json.dumps(view.keys[i], ensure_ascii=False) + "\n")
+            os.replace(tmp_keys, self._keys_path)
+            os.replace(tmp_data, self._data_path)
+            self._size = None
+        self.refresh()
+
+    @staticmethod
+    def _top(view, scores, top):
+        scores[~view.live] = np.inf
+        top = min(top, int(np.isfinite(scores).sum()))
+        if top <= 0:
+            return []
+        best = np.argpartition(scores, top - 1)[:top]
+        return best[np.argsort(scores[best], kind="stable")]
+
+    @staticmethod
+    def _columns(data):
+        # 逐块返回 (起始行, (4, n_colors, 块大小) 的按列副本)
+        for start in range(0, len(data), SEARCH_CHUNK):
+            yield start, np.ascontiguousarray(data[start:start + SEARCH_CHUNK].transpose(2, 1, 0))
+
+    @staticmethod
+    def _sq_dist(cols, lab):
+        # 块内每个颜色位到 lab 的平方色差，(n_colors, 块大小)
+        d = cols[0] - lab[0]
+        d *= d
+        for c in (1, 2):
+            e = cols[c] - lab[c]
+            e *= e
+            d += e
+        return d
+
+    def search_palette(self, colors, weights=None, top=10):
+        # 返回 [(键, 距离)]，距离越小越相近（单位为 ΔE）
+        self.refresh()
+        view = self._view
+        query = self.encode(colors, weights)
+        query = query[query[:, 3] > 0]
+        scores = np.empty(len(view.data), dtype=np.float32)
+        for start, cols in self._columns(view.data):
+            backward = np.zeros(cols.shape[2], dtype=np.float32)
+            nearest = None
+            for lab, w in zip(query[:, :3], query[:, 3]):
+                d = self._sq_dist(cols, lab)
+                # 查询色到该图色板的最近距离；补位的颜色与第一个颜色相同，不影响最小值
+                backward += w * np.sqrt(d.min(axis=0))
+                # 该图每个颜色到查询色板的最近距离
+                nearest = d if nearest is None else np.minimum(nearest, d, out=nearest)
+            # 补位的占比为 0，不计入加权和
+            forward = (np.sqrt(nearest, out=nearest) * cols[3]).sum(axis=0)
+            scores[start:start + len(backward)] = (forward + backward) / 2
+        best = self._top(view, scores, top)
+        return [(view.keys[i], round(float(scores[i]), 3)) for i in best]
+
+    def search_color(self, rgb, top=10, max_delta_e=None, min_weight=0.0):
+        # 返回 [(键, ΔE, 该颜色的占比)]：按色板中与 rgb 最接近的颜色排序
+        self.refresh()
+        view = self._view
+        target = srgb_to_lab(np.asarray(rgb, dtype=np.float64)).astype(np.float32)
+        scores = np.empty(len(view.data), dtype=np.float32)
+        shares = np.empty(len(view.data), dtype=np.float32)
+        for start, cols in self._columns(view.data):
+            d = self._sq_dist(cols, target)
+            if min_weight > 0:
+                d[cols[3] < min_weight] = np.inf
+            nearest = d.argmin(axis=0)
+            rows = np.arange(d.shape[1])
+            scores[start:start + len(rows)] = np.sqrt(d[nearest, rows])
+            shares[start:start + len(rows)] = cols[3][nearest, rows]
+        if max_delta_e is not None:
+            scores[scores > max_delta_e] = np.inf
+        best = self._top(view, scores, top)
+        return [(view.keys[i], round(float(scores[i]), 3), round(float(shares[i]), 4)) for i in best]
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+def get_index():
+    # 环境变量 PALETTE_INDEX 指定索引目录；未设置时返回 None
+    global _default_index
+    path = os.environ.get("PALETTE_INDEX")
+    if not path:
+        return None
+    with _default_lock:
+        if _default_index is None or _default_index.path != path:
+            _default_index = PaletteIndex(path)
+        return _default_index
+
+
+def image_palette(path, num_colors=5, method="kmeans", space="rgb"):
+    # 查询用：与批处理相同的取色流程，返回 (颜色, 占比)
+    from decode import DecodedUpload
+    from palette_image import center_crop_to_square, palette_hierarchy
+    with open(path, "rb") as fp:
+        upload = DecodedUpload(fp)
+    tree = palette_hierarchy(center_crop_to_square(upload.proxy), method, space)
+    picked = tree.pick_weighted(num_colors)
+    return [c for c, _ in picked], [w for _, w in picked]
+
+
+def main(argv=None):
+    # python palette_index.py 索引目录 --image 图片.jpg      色板最相近的图片
+    # python palette_index.py 索引目录 --color "#2a6fdb"     含有该颜色的图片（--min-weight 要求占比）
+    # python palette_index.py 索引目录 --compact             清掉被覆盖的旧记录
+    # 索引由 palette_batch.py --index 索引目录 写入
+    parser = argparse.ArgumentParser(description="按色板查找图片")
+    parser.add_argument("index", help="索引目录")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--image", help="查找色板与这张图片最相近的图片")
+    group.add_argument("--color", help="查找含有该颜色（#RRGGBB）的图片")
+    group.add_argument("--compact", action="store_true", help="清掉被覆盖的旧记录")
+    parser.add_argument("--top", type=int, default=10, help="返回的条数")
+    parser.add_argument("--colors", type=int, default=5, help="--image 时取色数量")
+    parser.add_argument("--max-delta-e", type=float, default=None, help="--color 时最大色差")
+    parser.add_argument("--min-weight", type=float, default=0.0, help="--color 时该颜色的最小像素占比")
+    args = parser.parse_args(argv)
+    index = PaletteIndex(args.index)
+    if args.compact:
+        index.compact()
+        print(f"索引共 {len(index)} 条")
+        return 0
+    if args.image:
+        colors, weights = image_palette(args.image, args.colors)
+        results = index.search_palette(colors, weights, args.top)
+    else:
+        from palette_image import hex_to_rgb
+        results = index.search_color(hex_to_rgb(args.color), args.top, args.max_delta_e, args.min_weight)
+    for row in results:
+        print("\t".join(str(v) for v in row))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
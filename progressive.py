@@ -0,0 +1,45 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import guardrails
+
+# 渐进模式的后台任务：页面先显示粗略色板，细化聚类和预览渲染在这里的线程池中执行，
+# 完成后页面再换上细化结果。同一会话同一时刻只保留一个任务：参数一变就取消旧任务——
+# 还在排队的直接撤下，正在执行的在下一个 guardrails.checkpoint() 处中止，不再占用 CPU。
+#   PALETTE_REFINE_WORKERS   后台细化的线程数（默认 CPU 核数）
+
+REFINE_WORKERS = int(os.environ.get("PALETTE_REFINE_WORKERS", os.cpu_count() or 2))
+
+_executor = ThreadPoolExecutor(max_workers=REFINE_WORKERS, thread_name_prefix="palette-refine")
+
+
+class Job:
+    def __init__(self, key, fn, *args):
+        self.key = key
+        self.cancelled = threading.Event()
+        self.future = _executor.submit(self._run, fn, args)
+
+    def _run(self, fn, args):
+        with guardrails.cancellable(self.cancelled):
+            guardrails.checkpoint()
+            return fn(*args)
+
+    def cancel(self):
+        self.cancelled.set()
+        self.future.cancel()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+
+def replace(current, key, fn, *args):
+    # 返回 key 对应的任务：与 current 相同时沿用，否则取消 current 并提交新任务
+    if current is not None and current.key == key and not current.cancelled.is_set():
+        return current
+    if current is not None:
+        current.cancel()
+    return Job(key, fn, *args)
@@ -0,0 +1,375 @@
+import time
+
+import numpy as np
+from PIL import Image
+
+from colorspace import SPACES, delta_e, from_space, srgb_to_lab, to_space
+from guardrails import checkpoint
+from timing import note
+
+# 主色提取引擎：extract_colors 统一入口，method 选择后端
+#   kmeans     —— sklearn KMeans，直接在采样像素上聚类（原始实现）
+#   histogram  —— 先把像素按每通道 5 bit 分箱成带权 3D 直方图，再对几千个非空箱做带权 k-means
+#   mediancut  —— Pillow 内置的中位切分量化
+# 后端返回 (聚类中心, 像素数)，extract_colors 按像素数从多到少排序成 [(r, g, b), ...]；
+# init 为上一级样本的聚类中心，支持的后端用它热启动（中位切分忽略）
+# space 选择聚类所在的色彩空间（rgb / lab / oklab，见 colorspace.py），感知均匀的空间里
+# 同样的 k 能分出更多肉眼可辨的颜色；merge_delta_e 合并 ΔE 低于阈值的近似重复色
+#
+# 采样：不再把图片重采样成固定的 200x200（会拉伸非方形图，还要对整图做一次重采样），
+# 而是直接从像素数组里取不超过 budget 个点，sampling 选择取法：
+#   stride      —— 等间距网格（跨步视图，零拷贝）
+#   random      —— 均匀随机
+#   stratified  —— 分层：每个网格单元内随机取一点，覆盖均匀又不会与规则纹理对齐
+# early_stop 时从样本的随机前缀开始逐级加大（1/16 → 1/8 → 全部），相邻两级的色板
+# 差异（按像素数加权的平均 ΔE）小于 CONVERGE_DELTA_E 就提前结束，纯色海报这类简单图
+# 只需聚类几千个点；复杂图的后一级从前一级的中心热启动，多出的开销很小
+
+SAMPLE_BUDGET = 40_000
+SAMPLERS = ("stride", "random", "stratified")
+PROGRESSIVE_STEPS = (1 / 16, 1 / 8, 1)
+MIN_POINTS_PER_COLOR = 50
+CONVERGE_DELTA_E = 2.0
+HIST_BITS = 5
+
+
+def sample_pixels(image, budget=SAMPLE_BUDGET, sampling="stride", seed=0):
+    # 返回 (n, 3) 的 uint8 像素，n 约不超过 budget
+    if sampling not in SAMPLERS:
+        raise ValueError(f"未知的采样方式：{sampling}")
+    arr = np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+    h, w = arr.shape[:2]
+    if h * w <= budget:
+        return arr.reshape(-1, 3)
+    rng = np.random.default_rng(seed)
+    if sampling == "random":
+        # 有放回抽样：budget 远小于像素数，重复几乎可以忽略，也省去整图洗牌
+        return arr.reshape(-1, 3)[rng.integers(0, h * w, budget)]
+    step = int(np.ceil(np.sqrt(h * w / budget)))
+    if sampling == "stride":
+        return arr[step // 2::step, step // 2::step].reshape(-1, 3)
+    ys = np.arange(0, h, step)[:, None] + rng.integers(0, step, (-(-h // step), -(-w // step)))
+    xs = np.arange(0, w, step)[None, :] + rng.integers(0, step, ys.shape)
+    return arr[np.minimum(ys, h - 1), np.minimum(xs, w - 1)].reshape(-1, 3)
+
+
+def sq_distances(points, centers):
+    # (n, d) x (k, d) -> (n, k) 欧氏距离平方
+    d = (points ** 2).sum(1)[:, None] - 2 * points @ centers.T + (centers ** 2).sum(1)[None, :]
+    return np.maximum(d, 0)
+
+
+def kmeans_pp(points, weights, k, rng):
+    # 带权 k-means++ 初始化
+    n = len(points)
+    prob = weights / weights.sum()
+    centers = np.empty((k, points.shape[1]))
+    centers[0] = points[rng.choice(n, p=prob)]
+    closest = sq_distances(points, centers[:1])[:, 0]
+    for i in range(1, k):
+        score = weights * closest
+        total = score.sum()
+        idx = rng.choice(n, p=score / total) if total > 0 else rng.choice(n, p=prob)
+        centers[i] = points[idx]
+        closest = np.minimum(closest, sq_distances(points, centers[i:i + 1])[:, 0])
+    return centers
+
+
+def weighted_kmeans(points, weights, k, max_iter=50, tol=1e-3, seed=42, init=None):
+    # init 给定时（形如 (k, d)）从这些中心热启动，跳过 k-means++
+    points = np.asarray(points, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    if init is not None and len(init) == k:
+        centers = np.array(init, dtype=np.float64)
+    else:
+        centers = kmeans_pp(points, weights, k, np.random.default_rng(seed))
+
+    for _ in range(max_iter):
+        labels = sq_distances(points, centers).argmin(1)
+        mass = np.bincount(labels, weights=weights, minlength=k)
+        sums = np.stack(
+            [np.bincount(labels, weights=weights * points[:, c], minlength=k) for c in range(points.shape[1])],
+            axis=1,
+        )
+        new_centers = centers.copy()
+        filled = mass > 0
+        new_centers[filled] = sums[filled] / mass[filled, None]
+        shift = ((new_centers - centers) ** 2).sum()
+        centers = new_centers
+        if shift < tol:
+            break
+
+    labels = sq_distances(points, centers).argmin(1)
+    mass = np.bincount(labels, weights=weights, minlength=k)
+    return centers, mass
+
+
+def color_histogram(arr, bits=HIST_BITS):
+    # 返回非空箱的平均颜色及像素数
+    arr = np.asarray(arr, dtype=np.int64)
+    q = arr >> (8 - bits)
+    idx = (q[:, 0] << (2 * bits)) | (q[:, 1] << bits) | q[:, 2]
+    n_bins = 1 << (3 * bits)
+    counts = np.bincount(idx, minlength=n_bins)
+    occupied = np.flatnonzero(counts)
+    sums = np.stack([np.bincount(idx, weights=arr[:, c], minlength=n_bins)[occupied] for c in range(3)], axis=1)
+    counts = counts[occupied]
+    return sums / counts[:, None], counts
+
+
+def order_by_population(centers, mass, num_colors):
+    mass = np.asarray(mass)
+    order = np.argsort(-mass, kind="stable")
+    # 空簇（像素数为 0）不参与排序，避免补出无意义的颜色
+    order = order[mass[order] > 0] if (mass > 0).any() else order
+    colors = [tuple(int(v) for v in c) for c in np.clip(centers[order], 0, 255).astype(int)]
+    # 颜色种类比 num_colors 少时用最多的颜色补齐，保证长度一致
+    while len(colors) < num_colors:
+        colors.append(colors[0])
+    return colors
+
+
+def _kmeans_centers(arr, k, space="rgb", init=None):
+    # sklearn 导入要一两秒，推迟到第一次用 kmeans 聚类时（可由 warm_up 提前完成）
+    from sklearn.cluster import KMeans
+    if init is not None and len(init) == k:
+        kmeans = KMeans(n_clusters=k, init=init, n_init=1, random_state=42)
+    else:
+        kmeans = KMeans(n_clusters=k, random_state=42)
+    kmeans.fit(to_space(arr, space))
+    return kmeans.cluster_centers_, np.bincount(kmeans.labels_, minlength=k)
+
+
+def _histogram_centers(arr, k, space="rgb", init=None):
+    # 分箱在 RGB 上做，只把几千个箱的平均色换算到目标空间，换算开销可以忽略
+    bins, counts = color_histogram(arr)
+    bins = to_space(bins, space)
+    if len(bins) <= k:
+        return bins, counts
+    return weighted_kmeans(bins, counts, k, init=init)
+
+
+def _mediancut_centers(arr, k, space="rgb", init=None):
+    # 中位切分只能在 RGB 上做，结果再换算到目标空间
+    img = Image.fromarray(arr.reshape(-1, 1, 3).astype(np.uint8))
+    quant = img.quantize(colors=k, method=Image.Quantize.MEDIANCUT)
+    pal = np.array(quant.getpalette()[:3 * k]).reshape(-1, 3)
+    mass = np.bincount(np.asarray(quant).ravel(), minlength=k)[:len(pal)]
+    return to_space(pal, space), mass
+
+
+QUANTIZERS = {
+    "kmeans": _kmeans_centers,
+    "histogram": _histogram_centers,
+    "mediancut": _mediancut_centers,
+}
+
+
+def palette_shift(a, mass_a, b, mass_b, space="rgb"):
+    # 两组中心之间的差异：每个颜色到另一组最近颜色的 ΔE，按像素数加权平均，取两个方向的较大值
+    lab_a = srgb_to_lab(from_space(a, space))
+    lab_b = srgb_to_lab(from_space(b, space))
+    dist = delta_e(lab_a[:, None, :], lab_b[None, :, :])
+    forward = (dist.min(axis=1) * mass_a).sum() / max(mass_a.sum(), 1e-12)
+    backward = (dist.min(axis=0) * mass_b).sum() / max(mass_b.sum(), 1e-12)
+    return max(forward, backward)
+
+
+def extract_centroids(image, k, method="kmeans", space="rgb",
+                      sampling="stride", budget=SAMPLE_BUDGET, early_stop=True):
+    # 返回未排序的聚类中心（位于 space 色彩空间）及各自的像素数（按完整样本折算）
+    if method not in QUANTIZERS:
+        raise ValueError(f"未知的取色算法：{method}")
+    if space not in SPACES:
+        raise ValueError(f"未知的色彩空间：{space}")
+    quantize = QUANTIZERS[method]
+    pixels = sample_pixels(image, budget, sampling)
+    n = len(pixels)
+    sizes = [int(n * f) for f in PROGRESSIVE_STEPS if n * f >= k * MIN_POINTS_PER_COLOR] if early_stop else []
+    if len(sizes) < 2:
+        sizes = [n]
+    # 随机前缀：每一级都是上一级的超集，且都近似均匀覆盖整张图
+    order = np.random.default_rng(0).permutation(n) if len(sizes) > 1 else None
+    prev = None
+    for size in sizes:
+        checkpoint()
+        subset = pixels if size == n else pixels[order[:size]]
+        # 从上一级的中心热启动：更大的样本只需迭代几轮，相邻两级的结果也更可比
+        centers, mass = quantize(subset, k, space, init=None if prev is None else prev[0])
+        centers = np.asarray(centers, dtype=np.float64)
+        mass = np.asarray(mass, dtype=np.float64) * (n / size)
+        if prev is not None and palette_shift(centers, mass, *prev, space) < CONVERGE_DELTA_E:
+            break
+        prev = centers, mass
+    note(sample_points=size)
+    return centers, mass
+
+
+def merge_close_centers(centers, mass, threshold, space="rgb"):
+    # 反复合并 ΔE（CIE76）小于 threshold 的最近一对中心，按像素数加权平均
+    centers = np.array(centers, dtype=np.float64)
+    mass = np.array(mass, dtype=np.float64)
+    while len(centers) > 1:
+        lab = srgb_to_lab(from_space(centers, space))
+        dist = delta_e(lab[:, None, :], lab[None, :, :])
+        dist[np.diag_indices(len(centers))] = np.inf
+        i, j = np.unravel_index(np.argmin(dist), dist.shape)
+        if dist[i, j] >= threshold:
+            break
+        total = mass[i] + mass[j]
+        if total > 0:
+            centers[i] = (centers[i] * mass[i] + centers[j] * mass[j]) / total
+        mass[i] = total
+        centers = np.delete(centers, j, axis=0)
+        mass = np.delete(mass, j)
+    return centers, mass
+
+
+# 1. 主色提取
+def extract_colors(image, num_colors=5, method="kmeans", space="rgb", merge_delta_e=None,
+                   sampling="stride", budget=SAMPLE_BUDGET, early_stop=True):
+    opts = dict(method=method, space=space, sampling=sampling, budget=budget, early_stop=early_stop)
+    if not merge_delta_e:
+        centers, mass = extract_centroids(image, num_colors, **opts)
+    else:
+        # 先多聚一倍，合并感知上几乎相同的颜色，再收缩到 num_colors
+        centers, mass = extract_centroids(image, num_colors * 2, **opts)
+        centers, mass = merge_close_centers(centers, mass, merge_delta_e, space)
+        if len(centers) > num_colors:
+            centers, mass = weighted_kmeans(centers, mass, num_colors)
+    return order_by_population(from_space(centers, space), mass, num_colors)
+
+
+def warm_up(methods=("kmeans",), space="rgb"):
+    # 在一张小渐变图上各跑一次取色：完成 sklearn 导入、线程池和 BLAS 的首次初始化，
+    # 之后第一个真实请求不再承担这些一次性开销。返回各后端耗时（毫秒）
+    ramp = np.linspace(0, 255, 64, dtype=np.uint8)
+    image = Image.fromarray(np.stack([*np.meshgrid(ramp, ramp[::-1]), np.full((64, 64), 128, np.uint8)], axis=-1))
+    timings = {}
+    for method in methods:
+        start = time.perf_counter()
+        extract_colors(image, 5, method=method, space=space)
+        timings[method] = round((time.perf_counter() - start) * 1000, 2)
+    return timings
+
+
+# 2. 流式取色：大图导出、“整本相册的色板”这类任务要代表全部像素而不是一张缩略图。
+# 图片按行切成条带逐块喂入，每块先压成 5 bit 直方图（像素一个不漏，但点数有上限），
+# 再对 n_codes 个码字做带权 mini-batch k-means 更新（Sculley 2010，学习率 1/累计像素数）。
+# 每张图只额外保存“各码字分到的像素数与颜色和”，内存与图片大小、张数基本无关；
+# 最后在码字上做带权 k-means 得到合并色板和各图自己的色板。
+# max_codes 大于 n_codes 时，码字可以随新内容增加（视频换场景、相册换主题）：一批像素里离所有码字
+# 都超过 NOVEL_DISTANCE 的部分占比不小时，从这部分再补 n_codes // 4 个码字，直到 max_codes。
+
+N_CODES = 64
+TILE_PIXELS = 512 * 512
+NOVEL_DISTANCE = 24.0
+NOVEL_SHARE = 0.01
+
+
+def iter_tiles(image, tile_pixels=TILE_PIXELS):
+    # 按整行切成约 tile_pixels 像素的条带，返回 (n, 3) 像素块
+    w, h = image.size
+    rows = max(1, tile_pixels // max(w, 1))
+    for top in range(0, h, rows):
+        tile = image.crop((0, top, w, min(h, top + rows)))
+        yield np.asarray(tile if tile.mode == "RGB" else tile.convert("RGB")).reshape(-1, 3)
+
+
+class StreamingPalette:
+    def __init__(self, n_codes=N_CODES, space="rgb", seed=42, max_codes=None):
+        if space not in SPACES:
+            raise ValueError(f"未知的色彩空间：{space}")
+        self.n_codes = n_codes
+        self.max_codes = max(max_codes or n_codes, n_codes)
+        self.space = space
+        self.rng = np.random.default_rng(seed)
+        self.codes = np.empty((0, 3))
+        self.seen = np.zeros(0)
+        # 键 -> [各码字的像素数, 各码字的颜色和]；None 键为合计
+        self.stats = {}
+
+    def _grow(self, points, weights, need=None):
+        # 码字不足时按 k-means++ 的方式从新样本里补：离现有码字越远越容易被选中
+        if need is None:
+            need = self.n_codes - len(self.codes)
+        if len(self.codes) == 0:
+            self.codes = points[[self.rng.choice(len(points), p=weights / weights.sum())]]
+            need -= 1
+        closest = sq_distances(points, self.codes).min(1)
+        added = []
+        for _ in range(need):
+            score = weights * closest
+            total = score.sum()
+            if total <= 0:
+                break
+            idx = self.rng.choice(len(points), p=score / total)
+            added.append(points[idx])
+            closest = np.minimum(closest, sq_distances(points, points[idx:idx + 1])[:, 0])
+        if added:
+            self.codes = np.vstack([self.codes, added])
+        grown = len(self.codes) - len(self.seen)
+        self.seen = np.concatenate([self.seen, np.zeros(grown)])
+        for mass, sums in self.stats.values():
+            mass.resize(len(self.codes), refcheck=False)
+            sums.resize((len(self.codes), 3), refcheck=False)
+
+    def partial_fit(self, pixels, key=None):
+        bins, counts = color_histogram(np.asarray(pixels).reshape(-1, 3))
+        if len(bins) == 0:
+            return self
+        points = to_space(bins, self.space)
+        counts = counts.astype(np.float64)
+        if len(self.codes) < self.n_codes:
+            self._grow(points, counts)
+        elif len(self.codes) < self.max_codes:
+            novel = sq_distances(points, self.codes).min(1) > NOVEL_DISTANCE ** 2
+            if counts[novel].sum() > NOVEL_SHARE * counts.sum():
+                self._grow(points[novel], counts[novel], min(self.n_codes // 4, self.max_codes - len(self.codes)))
+        k = len(self.codes)
+        labels = sq_distances(points, self.codes).argmin(1)
+        mass = np.bincount(labels, weights=counts, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=counts * points[:, c], minlength=k) for c in range(3)], axis=1)
+        # mini-batch 更新：码字向本批的均值移动，步长为本批像素数 / 累计像素数
+        self.seen += mass
+        hit = mass > 0
+        self.codes[hit] += (sums[hit] / mass[hit, None] - self.codes[hit]) * (mass[hit] / self.seen[hit])[:, None]
+        for name in {None, key}:
+            acc = self.stats.setdefault(name, [np.zeros(k), np.zeros((k, 3))])
+            acc[0] += mass
+            acc[1] += sums
+        return self
+
+    def add_image(self, image, key=None, tile_pixels=TILE_PIXELS):
+        for tile in iter_tiles(image, tile_pixels):
+            self.partial_fit(tile, key)
+        return self
+
+    def keys(self):
+        return [key for key in self.stats if key is not None]
+
+    def palette(self, num_colors=5, key=None):
+        # key 为 None 时返回所有输入合并后的色板
+        mass, sums = self.stats[key]
+        filled = mass > 0
+        centers, mass = sums[filled] / mass[filled, None], mass[filled]
+        if len(centers) > num_colors:
+            centers, mass = weighted_kmeans(centers, mass, num_colors)
+        return order_by_population(from_space(centers, self.space), mass, num_colors)
+
+
+def extract_colors_streaming(images, num_colors=5, space="rgb", n_codes=N_CODES, tile_pixels=TILE_PIXELS):
+    # images：(键, 图片) 的可迭代对象，图片可以是 PIL Image 或像素块 (n, 3) 的可迭代对象；
+    # 图片按需逐张读取，可以直接传生成器。返回 (合并色板, {键: 该图色板})
+    stream = StreamingPalette(n_codes, space)
+    for key, image in images:
+        if isinstance(image, Image.Image):
+            stream.add_image(image, key, tile_pixels)
+        else:
+            for tile in image:
+                stream.partial_fit(tile, key)
+        # 取下一张之前先放掉这一张，否则解码下一张时两张图同时在内存里
+        del image
+    if not stream.stats:
+        raise ValueError("没有可取色的像素")
+    return stream.palette(num_colors), {key: stream.palette(num_colors, key) for key in stream.keys()}
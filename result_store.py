@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from timing import note
+
+# 跨会话、跨进程共享的结果库：键为（原图内容哈希, 参数…）的摘要，值为字节（色板图、壁纸、zip）
+# 或 JSON（取色结果）。同一张图片被不同用户上传时直接返回上次的结果。
+# 存储为单个 SQLite 文件（WAL 模式），多个 Streamlit/uvicorn 进程可同时读写；
+# 总大小超过上限时按最近访问时间淘汰。环境变量：
+#   PALETTE_STORE          数据库文件路径，不设置则不启用
+#   PALETTE_STORE_MAX_MB   大小上限（默认 512）
+
+DEFAULT_MAX_MB = 512
+TOUCH_INTERVAL = 60  # 秒；读命中时最多这么久更新一次访问时间，避免每次读都写库
+EVICT_TO = 0.9  # 淘汰到上限的 90%，避免每次写入都触发淘汰
+VERSION = 1  # 渲染结果或取色算法变化导致旧结果失效时加 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+"""
+
+
+def content_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def store_key(*parts):
+    # 参数可以是任意可 JSON 序列化的值；tuple 与 list 视为相同
+    text = json.dumps([VERSION, *parts], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+
+class ResultStore:
+    def __init__(self, path, max_bytes=DEFAULT_MAX_MB * 2 ** 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # 每个线程一个连接；sqlite3 连接不能跨线程共享
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value, accessed FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and time.time() - row[1] > TOUCH_INTERVAL:
+                conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return bytes(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), len(value), now, now),
+            )
+            self._evict(conn)
+        except sqlite3.Error:
+            # 库被锁太久或磁盘已满时放弃写入，结果照常返回给调用方
+            pass
+        return value
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # BEGIN IMMEDIATE 拿写锁，多个进程同时超限时只有一个在淘汰
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0] \
+                - int(self.max_bytes * EVICT_TO)
+            freed = 0
+            victims = []
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+                if freed >= excess:
+                    break
+                victims.append((key,))
+                freed += size
+            conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_json(self, key):
+        value = self.get(key)
+        return None if value is None else json.loads(value)
+
+    def put_json(self, key, value):
+        self.put(key, json.dumps(value, ensure_ascii=False).encode())
+        return value
+
+    def stats(self):
+        conn = self._connect()
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": count,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        self._connect().execute("DELETE FROM entries")
+        self.hits = self.misses = 0
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_store():
+    # 未设置 PALETTE_STORE 时返回 None
+    global _default_store
+    path = os.environ.get("PALETTE_STORE")
+    if not path:
+        return None
+    with _default_lock:
+        if _default_store is None or _default_store.path != path:
+            max_mb = float(os.environ.get("PALETTE_STORE_MAX_MB", DEFAULT_MAX_MB))
+            _default_store = ResultStore(path, int(max_mb * 2 ** 20))
+        return _default_store
+
+
+def cached_bytes(parts, compute, label="result_store"):
+    # 按 parts 在共享结果库中查找，未命中时计算并写入；未启用结果库时直接计算
+    store = get_store()
+    if store is None:
+        return compute()
+    key = store_key(*parts)
+    value = store.get(key)
+    note(**{label: "hit" if value is not None else "miss"})
+    if value is None:
+        value = store.put(key, compute())
+    return value
@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+import time
+
+import timing
+from quantize import warm_up as warm_up_quantizer
+
+# 冷启动：sklearn 等重依赖推迟到第一次用到时才导入（见 quantize._kmeans_centers、frames.load_av），
+# 进程启动时只加载轻量模块；随后由 start() 在后台线程里预热取色引擎，
+# 让第一个用户不必承担导入 sklearn 和首次拟合的一两秒。
+# 每个进程各输出一次 startup（入口模块导入耗时、预热耗时）和 first_request（第一个请求的耗时）计时日志，
+# stats() 供 /health 和调试面板查看。
+#   PALETTE_WARMUP   background（默认）后台预热 | sync 启动时同步预热，完成后才接受请求 | off 不预热
+#   PALETTE_WARMUP_METHODS   预热的取色算法，逗号分隔（默认 kmeans）
+
+WARMUP = os.environ.get("PALETTE_WARMUP", "background")
+WARMUP_METHODS = tuple(m for m in os.environ.get("PALETTE_WARMUP_METHODS", "kmeans").split(",") if m)
+
+_lock = threading.Lock()
+_state = {"entry": None, "import_ms": None, "warmup": WARMUP, "warm": False, "warmup_ms": None,
+          "first_request_ms": None}
+_warmed = threading.Event()
+
+
+def warm_up():
+    start = time.perf_counter()
+    with timing.trace("warmup") as t:
+        t.set(methods_ms=warm_up_quantizer(WARMUP_METHODS))
+    _state["warmup_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    _state["warm"] = True
+    _warmed.set()
+
+
+def _warm_up_quietly():
+    # 后台预热失败不影响服务，第一个请求照常按需导入
+    try:
+        warm_up()
+    except Exception:
+        _warmed.set()
+
+
+def start(entry, started):
+    # 入口模块导入完成后调用一次，started 为入口模块开始导入时的 time.perf_counter()；
+    # 同一进程里重复调用（如 Streamlit 每次 rerun）什么也不做
+    with _lock:
+        if _state["entry"] is not None:
+            return
+        _state["entry"] = entry
+        _state["import_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    record = {"event": "startup", "entry": entry, "import_ms": _state["import_ms"], "warmup": WARMUP}
+    timing.logger.info(json.dumps(record, ensure_ascii=False))
+    if WARMUP == "sync":
+        warm_up()
+    elif WARMUP == "background":
+        threading.Thread(target=_warm_up_quietly, name="palette-warmup", daemon=True).start()
+    else:
+        _warmed.set()
+
+
+def wait(timeout=None):
+    # 等待预热结束（基准测试和就绪检查用），返回是否已完成
+    return _warmed.wait(timeout)
+
+
+def first_request(total_ms):
+    # 记录本进程第一个请求的耗时，只记一次
+    with _lock:
+        if _state["first_request_ms"] is not None:
+            return
+        _state["first_request_ms"] = round(total_ms, 2)
+    record = {"event": "first_request", "entry": _state["entry"], "total_ms": _state["first_request_ms"],
+              "warm": _state["warm"]}
+    timing.logger.info(json.dumps(record, ensure_ascii=False))
+
+
+def stats():
+    return dict(_state)
@@ -0,0 +1,88 @@
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+# 色块条带光栅化：整条色板在 NumPy 里一次算出，再一次性粘贴到色板图上，代替逐格 ImageDraw 调用。
+# 每种形状用有符号距离场（SDF，像素中心到边缘的距离，内部为负）生成覆盖率蒙版，
+# 覆盖率 = clip(0.5 - 距离, 0, 1)，相当于边缘 1 像素宽的抗锯齿，无需超采样。
+# 同一形状、同一边长的蒙版只算一次，所有色块共用。
+
+SHAPES = ("方形", "圆形", "圆角方形", "六边形")
+MAX_CELLS = 255  # 查找表索引为 uint16：色块序号 * 256 + 覆盖率
+CORNER_RADIUS = 0.2  # 圆角方形的圆角半径，占色块边长的比例
+
+
+def _sdf_square(x, y, half):
+    return np.maximum(np.abs(x), np.abs(y)) - half
+
+
+def _sdf_circle(x, y, half):
+    return np.hypot(x, y) - half
+
+
+def _sdf_rounded(x, y, half):
+    radius = half * 2 * CORNER_RADIUS
+    qx = np.abs(x) - (half - radius)
+    qy = np.abs(y) - (half - radius)
+    outside = np.hypot(np.maximum(qx, 0), np.maximum(qy, 0))
+    return outside + np.minimum(np.maximum(qx, qy), 0) - radius
+
+
+def _sdf_hexagon(x, y, half):
+    # 平顶正六边形，左右两个顶点贴住色块边缘（外接圆半径 = half）
+    inner = half * np.sqrt(3) / 2
+    x, y = np.abs(x), np.abs(y)
+    # 斜边的法向 (sin60°, cos60°)
+    return np.maximum(y, x * np.sqrt(3) / 2 + y / 2) - inner
+
+
+SDFS = {
+    "方形": _sdf_square,
+    "圆形": _sdf_circle,
+    "圆角方形": _sdf_rounded,
+    "六边形": _sdf_hexagon,
+}
+
+
+@lru_cache(maxsize=32)
+def coverage_mask(shape, size):
+    # (size, size) 的 uint8 覆盖率，0 为背景、255 为色块；返回只读数组供各色块共用
+    if shape not in SDFS:
+        raise ValueError(f"未知的色块形状：{shape}")
+    half = size / 2
+    coords = np.arange(size, dtype=np.float32) + 0.5 - half
+    dist = SDFS[shape](coords[None, :], coords[:, None], half)
+    mask = np.rint(np.clip(0.5 - dist, 0, 1) * 255).astype(np.uint8)
+    mask.setflags(write=False)
+    return mask
+
+
+def render_swatches(palette, n_per_row, n_rows, cell_size, cell_gap, bg_color, shape="方形"):
+    # 返回 RGB 条带图：n_rows 行、每行 n_per_row 个色块，色块间距 cell_gap
+    # palette 不足 n_per_row * n_rows 个颜色时，空位保持背景色
+    n_cells = n_rows * n_per_row
+    if n_cells > MAX_CELLS:
+        raise ValueError(f"色块数量不能超过 {MAX_CELLS}")
+    bg = np.asarray(bg_color, dtype=np.float32)
+    colors = np.tile(bg, (n_cells, 1))
+    count = min(len(palette), n_cells)
+    if count:
+        colors[:count] = np.asarray(palette[:count], dtype=np.float32)
+    # 查找表：lut[色块序号 * 256 + 覆盖率] = 该覆盖率下色块色与背景色的混合结果，
+    # 每项打包成一个 uint32（RGBX），查表时一次搬 4 字节
+    alpha = np.arange(256, dtype=np.float32)[None, :, None] / 255
+    lut = np.zeros((n_cells, 256, 4), dtype=np.uint8)
+    lut[..., :3] = np.rint(bg + alpha * (colors[:, None, :] - bg))
+    lut = lut.reshape(-1).view(np.uint32)
+    # 一个 pitch × pitch 的格子：左上角是色块蒙版，右侧和下方的间距覆盖率为 0（即背景色）
+    pitch = cell_size + cell_gap
+    tile = np.zeros((pitch, pitch), dtype=np.uint16)
+    tile[:cell_size, :cell_size] = coverage_mask(shape, cell_size)
+    cell_ids = np.arange(n_cells, dtype=np.uint16).reshape(n_rows, 1, n_per_row, 1) * 256
+    index = (cell_ids + tile[None, :, None, :]).reshape(n_rows * pitch, n_per_row * pitch)
+    # 整条色板只做一次查表
+    height, width = n_rows * pitch - cell_gap, n_per_row * pitch - cell_gap
+    pixels = np.ascontiguousarray(lut[index[:height, :width]])
+    # Pillow 12 的 frombuffer("RGB", ..., "RGBX") 得到的是 RGBX 图，由 Pillow 去掉填充字节转成 RGB
+    return Image.frombuffer("RGBX", (width, height), pixels, "raw", "RGBX", 0, 1).convert("RGB")
@@ -0,0 +1,106 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# 分阶段计时：一次请求（一次页面 rerun、一次下载、一张批处理图片）对应一个 Trace，
+# 调用链深处用 stage()/note() 记录，不需要层层传参；没有活动 Trace 时它们什么也不做。
+# Trace 结束时输出一行 JSON 日志，便于在生产环境汇总。
+
+logger = logging.getLogger("palette.timing")
+_current = contextvars.ContextVar("palette_trace", default=None)
+
+
+class Trace:
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = dict(fields)
+        self.stages = {}
+        self.start = time.perf_counter()
+        self.total_ms = None
+        self._token = None
+
+    def add(self, stage_name, seconds):
+        # 同一阶段多次出现时累加
+        self.stages[stage_name] = self.stages.get(stage_name, 0.0) + seconds * 1000
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def as_dict(self):
+        total = self.total_ms if self.total_ms is not None else (time.perf_counter() - self.start) * 1000
+        return {
+            "event": self.name,
+            "total_ms": round(total, 2),
+            "stages_ms": {k: round(v, 2) for k, v in self.stages.items()},
+            **self.fields,
+        }
+
+    def finish(self):
+        if self.total_ms is not None:
+            return self.as_dict()
+        self.total_ms = (time.perf_counter() - self.start) * 1000
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+        record = self.as_dict()
+        logger.info(json.dumps(record, ensure_ascii=False, default=str))
+        return record
+
+
+def begin(name, **fields):
+    # 开始一个 Trace 并设为当前上下文的活动 Trace，需配对调用 finish()
+    t = Trace(name, **fields)
+    t._token = _current.set(t)
+    return t
+
+
+@contextmanager
+def trace(name, **fields):
+    t = begin(name, **fields)
+    try:
+        yield t
+    except Exception as e:
+        t.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        t.finish()
+
+
+@contextmanager
+def stage(name):
+    t = _current.get()
+    if t is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        t.add(name, time.perf_counter() - start)
+
+
+def note(**fields):
+    t = _current.get()
+    if t is not None:
+        t.set(**fields)
+
+
+def current():
+    return _current.get()
+
+
+def configure_logging(stream=None):
+    # PALETTE_TIMING_LOG=0 关闭计时日志；默认输出到 stderr，每行一个 JSON
+    if os.environ.get("PALETTE_TIMING_LOG", "1") == "0":
+        logger.disabled = True
+        return
+    if not logger.handlers:
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
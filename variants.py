@@ -0,0 +1,108 @@
+import contextvars
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
+from PIL import Image
+
+import guardrails
+from encoders import OUTPUT_FORMATS, encode_image
+from layout import WALLPAPER_RATIOS, card_layout, fit_side, orientation, wallpaper_layout
+from palette_image import center_crop_to_square, make_wallpaper, palette_hierarchy, render_palette_card
+from timing import note, stage
+
+# 组合导出：一张图的 形状 × 边框色 × 壁纸比例 全部组合。
+# 解码、裁剪、缩放和聚类各只做一次，之后每个 (形状, 边框色) 在线程池里渲染色板图及其壁纸并编码；
+# Pillow 在缩放、编码时释放 GIL，多线程能真正并行。结果打包成一个 zip。
+
+DEFAULT_SHAPES = ("方形", "圆形")
+BG_COLORS = {"白色": (245, 245, 245), "黑色": (28, 28, 28)}
+VARIANT_WORKERS = int(os.environ.get("PALETTE_VARIANT_WORKERS", min(os.cpu_count() or 2, 8)))
+
+
+def wallpaper_suffix(ratio, device=None):
+    return "%dx%d" % tuple(device) if device else orientation(ratio)
+
+
+def render_bytes(size, num_colors=5, shapes=DEFAULT_SHAPES, bg_colors=BG_COLORS, wallpapers=None, max_edge=None,
+                 workers=None):
+    # 渲染阶段的峰值内存估计（不含解码，按 RGB 每像素 3 字节）：共用的方图，加上同时渲染的每个线程
+    # 各持有的一张色板图和其中最大的一张壁纸（按设备分辨率输出时另有缩放后的色板图），线程部分再乘 2 计入
+    # 缩放、粘贴和编码时的工作副本。
+    # 按设备分辨率输出的壁纸可达 8192x8192，几个线程同时渲染就是上 GB，须计入 guardrails 的预算。
+    # workers 为 None 时按 fit_workers 决定线程数
+    if workers is None:
+        return render_bytes(size, num_colors, shapes, bg_colors, wallpapers, max_edge,
+                            fit_workers(size, num_colors, shapes, bg_colors, wallpapers, max_edge))
+    if wallpapers is None:
+        wallpapers = [(ratio, None) for ratio in WALLPAPER_RATIOS.values()]
+    side = fit_side(min(size), num_colors, max_edge)
+    card = card_layout(side, num_colors)
+    largest = 0
+    for ratio, device in wallpapers:
+        layout = wallpaper_layout((card.width, card.height), tuple(ratio), device and tuple(device))
+        resized = layout.card_width * layout.card_height if device else 0
+        largest = max(largest, layout.width * layout.height + resized)
+    threads = max(1, min(workers, len(shapes) * len(bg_colors)))
+    return (side * side + threads * (card.width * card.height + largest) * 2) * 3
+
+
+def fit_workers(size, num_colors=5, shapes=DEFAULT_SHAPES, bg_colors=BG_COLORS, wallpapers=None, max_edge=None):
+    # 预算（扣掉全分辨率解码的占用）放不下 VARIANT_WORKERS 个线程同时渲染时减少线程数，而不是直接拒绝；
+    # 一个线程都放不下时由 guardrails 拒绝
+    budget = guardrails.gate.memory_budget - guardrails.estimate_bytes(size)
+    workers = VARIANT_WORKERS
+    while workers > 1 and render_bytes(size, num_colors, shapes, bg_colors, wallpapers, max_edge, workers) > budget:
+        workers -= 1
+    return workers
+
+
+def render_variants(upload, origin_name, shapes=DEFAULT_SHAPES, bg_colors=BG_COLORS, wallpapers=None,
+                    num_colors=5, wide_palette=False, method="kmeans", space="rgb", merge_delta_e=None,
+                    max_edge=None, fmt="png", fill_index=0, workers=None):
+    # upload 为 decode.DecodedUpload；bg_colors 为 {名称: RGB}；
+    # wallpapers 为 [(比例, 设备分辨率或 None)]，默认桌面 + 手机。返回 [(文件名, 字节)]
+    if wallpapers is None:
+        wallpapers = [(ratio, None) for ratio in WALLPAPER_RATIOS.values()]
+    with stage("crop"):
+        source = center_crop_to_square(upload.proxy)
+    palette = palette_hierarchy(source, method, space, merge_delta_e).pick(num_colors, wide_palette)
+    fill = palette[min(fill_index, len(palette) - 1)]
+    with stage("variants_prepare"):
+        # 所有组合共用同一张裁剪、缩放好的方图，render_palette_card 不会再裁剪或缩放
+        square = center_crop_to_square(upload.full())
+        side = fit_side(square.size[0], num_colors, max_edge)
+        if side < square.size[0]:
+            square = square.resize((side, side), Image.LANCZOS, reducing_gap=2.0)
+    ext = OUTPUT_FORMATS[fmt]["ext"]
+
+    def render(shape, bg_name):
+        card = render_palette_card(square, palette, bg_colors[bg_name], num_colors=num_colors, shape=shape)
+        stem = f"{origin_name}_{shape}_{bg_name}_palette"
+        files = [(f"{stem}.{ext}", encode_image(card, fmt)[0])]
+        for ratio, device in wallpapers:
+            wallpaper = make_wallpaper(card, ratio=ratio, color=fill, device=device)
+            files.append((f"{stem}_{wallpaper_suffix(ratio, device)}.{ext}", encode_image(wallpaper, fmt)[0]))
+        return files
+
+    combos = list(product(shapes, bg_colors))
+    if workers is None:
+        workers = fit_workers(upload.size, num_colors, shapes, bg_colors, wallpapers, max_edge)
+    # 每个组合在当前上下文的副本里执行，任务期限（guardrails.checkpoint）和计时在线程里照样生效
+    contexts = [contextvars.copy_context() for _ in combos]
+    with stage("variants_render"):
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(combos)))) as pool:
+            results = list(pool.map(lambda ctx, combo: ctx.run(render, *combo), contexts, combos))
+    note(variants=len(combos) * (1 + len(wallpapers)))
+    return [item for files in results for item in files]
+
+
+def build_zip(files):
+    # PNG/WebP/JPEG 本身已压缩，zip 只做存储，不再压缩一遍
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zf:
+        for name, data in files:
+            zf.writestr(name, data)
+    return buf.getvalue()